@@ -80,6 +80,7 @@ const translations = {
     'feedback.running.stage.variations': 'Stage: resolving variation data ({done}/{total}).',
     'feedback.running.stage.images': 'Stage: downloading product images...',
     'feedback.running.stage.default': 'Stage: running export pipeline...',
+    'feedback.running.eta': 'About {eta} left in this stage.',
     'feedback.success.title': 'Export completed',
     'feedback.success.body': 'All files were generated successfully and are ready for import.',
     'feedback.failed.title': 'Export failed',
@@ -141,6 +142,7 @@ const translations = {
     'feedback.running.stage.variations': 'Etape: resolution des variations ({done}/{total}).',
     'feedback.running.stage.images': 'Etape: telechargement des images produits...',
     'feedback.running.stage.default': "Etape: execution du pipeline d'export...",
+    'feedback.running.eta': 'Environ {eta} restant pour cette etape.',
     'feedback.success.title': 'Export termine',
     'feedback.success.body': 'Tous les fichiers ont ete generes avec succes et sont prets a importer.',
     'feedback.failed.title': "Echec de l'export",
@@ -202,6 +204,7 @@ const translations = {
     'feedback.running.stage.variations': 'Etapa: resolviendo variaciones ({done}/{total}).',
     'feedback.running.stage.images': 'Etapa: descargando imagenes de productos...',
     'feedback.running.stage.default': 'Etapa: ejecutando pipeline de exportacion...',
+    'feedback.running.eta': 'Quedan aproximadamente {eta} en esta etapa.',
     'feedback.success.title': 'Exportacion completada',
     'feedback.success.body': 'Todos los archivos se generaron correctamente y estan listos para importar.',
     'feedback.failed.title': 'Exportacion fallida',
@@ -209,6 +212,19 @@ const translations = {
   }
 };
 
+function formatEta(seconds) {
+  const total = Math.max(0, Math.round(seconds));
+  const hours = Math.floor(total / 3600);
+  const minutes = Math.floor((total % 3600) / 60);
+  if (hours > 0) {
+    return `${hours}h ${String(minutes).padStart(2, '0')}m`;
+  }
+  if (minutes > 0) {
+    return `${minutes}m ${String(total % 60).padStart(2, '0')}s`;
+  }
+  return `${total}s`;
+}
+
 function t(key, params = null) {
   const langTable = translations[currentLanguage] || translations.en;
   const base = langTable[key] || translations.en[key] || key;
@@ -286,11 +302,16 @@ function renderFeedback() {
       stageText = t('feedback.running.stage.images');
     }
 
+    const etaText = Number.isFinite(feedbackModel.etaSeconds)
+      ? `<p>${escapeHtml(t('feedback.running.eta', { eta: formatEta(feedbackModel.etaSeconds) }))}</p>`
+      : '';
+
     runFeedbackEl.className = 'run-feedback run-feedback--running';
     runFeedbackEl.innerHTML = `
       <strong>${escapeHtml(t('feedback.running.title'))}</strong>
       <p>${escapeHtml(stageText)}</p>
       <p>${escapeHtml(t('feedback.running.body', { discovered, processed, images }))}</p>
+      ${etaText}
     `;
     runFeedbackEl.hidden = false;
     return;
@@ -450,7 +471,8 @@ function startPolling(jobId) {
         processed: job.progress?.productsProcessed ?? 0,
         images: job.progress?.imagesDownloaded ?? 0,
         variationDone: job.progress?.variationProductsProcessed ?? 0,
-        variationTotal: job.progress?.variationProductsTotal ?? 0
+        variationTotal: job.progress?.variationProductsTotal ?? 0,
+        etaSeconds: job.progress?.etaSeconds ?? null
       });
 
       if (job.status === 'finished') {
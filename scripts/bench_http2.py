@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Benchmarks the worker's HTTP/2 transport against the urllib HTTP/1.1 path.
+
+Starts mock_store.py over TLS with HTTP/2 (hypercorn) on a free port, using a
+throwaway self-signed certificate made with the openssl CLI. It then exports
+the mock catalog alternately with {"http2": false} and {"http2": true} and
+reports the median wall time of each. The outputs of the two transports are
+also compared, so a faster run that drops data does not pass.
+
+Needs `pip install httpx h2 hypercorn` and openssl on PATH.
+
+    python3 scripts/bench_http2.py --products 300 --runs 3 --latency 0.03
+"""
+import argparse
+import os
+import shutil
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from check_sharded_export import compare, export_snapshot, run_worker
+
+SCRIPTS = Path(__file__).resolve().parent
+
+
+def make_certificate(directory: Path) -> Path:
+    certfile, keyfile = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+            "-keyout", str(keyfile), "-out", str(certfile),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return certfile
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def wait_for_tls(port: int, certfile: Path, timeout: float = 15.0) -> str:
+    # Returns the ALPN protocol the server picks, which confirms h2 is on offer.
+    context = ssl.create_default_context(cafile=str(certfile))
+    context.set_alpn_protocols(["h2", "http/1.1"])
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1) as raw:
+                with context.wrap_socket(raw, server_hostname="127.0.0.1") as tls:
+                    return tls.selected_alpn_protocol() or "http/1.1"
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=300)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--keep", action="store_true", help="keep the export folders")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="woo-http2-bench-"))
+    certfile = make_certificate(work_dir)
+    port = free_port()
+    # hypercorn logs every TLS connection urllib drops without close_notify.
+    server_log = (work_dir / "mock_store.log").open("w")
+    server = subprocess.Popen(
+        [
+            sys.executable, str(SCRIPTS / "mock_store.py"), "--http2", "--port", str(port),
+            "--products", str(args.products), "--latency", str(args.latency),
+            "--certfile", str(certfile), "--keyfile", str(work_dir / "key.pem"),
+        ],
+        stdout=server_log,
+        stderr=subprocess.STDOUT,
+    )
+    # The worker verifies TLS against the throwaway certificate instead of
+    # falling back to unverified connections.
+    os.environ["SSL_CERT_FILE"] = str(certfile)
+    timings: Dict[bool, List[float]] = {False: [], True: []}
+    summaries: Dict[bool, Dict[str, Any]] = {}
+    try:
+        protocol = wait_for_tls(port, certfile)
+        print(f"Mock store on https://127.0.0.1:{port}/ (ALPN {protocol}), latency {args.latency}s")
+        for run in range(args.runs):
+            for http2 in (False, True):
+                started = time.monotonic()
+                result = run_worker(
+                    {
+                        "url": f"https://127.0.0.1:{port}/",
+                        "exportDir": str(work_dir / f"{'h2' if http2 else 'h1'}-{run}"),
+                        "http2": http2,
+                    }
+                )
+                timings[http2].append(time.monotonic() - started)
+                summaries[http2] = result["summary"]
+        differences = compare(export_snapshot(work_dir / "h1-0"), export_snapshot(work_dir / "h2-0"))
+    finally:
+        server.terminate()
+        server.wait()
+        server_log.close()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    for http2, label in ((False, "HTTP/1.1 (urllib)"), (True, "HTTP/2 (httpx)")):
+        summary = summaries[http2]
+        print(
+            f"{label:18} median {statistics.median(timings[http2]):6.2f}s  "
+            f"runs {', '.join(f'{seconds:.2f}' for seconds in timings[http2])}  "
+            f"apiRequests={summary.get('apiRequests')} images={summary.get('imagesDownloaded')} "
+            f"http2Requests={summary.get('http2Requests')}"
+        )
+    if not summaries[True].get("http2Requests"):
+        print("No request went over HTTP/2; is httpx installed with h2?")
+    for difference in differences:
+        print(f"DIFFERENT {difference}")
+    if args.keep:
+        print(f"Exports kept in {work_dir}")
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Checks that a sharded crawl produces the same export as a single worker.
+
+Starts the mock store from mock_store.py on a free port, then runs the Python
+worker twice against it: once as a plain export and once with
+{"mode": "coordinate", "workers": N}. After that it compares metadata.json,
+the import CSV, fingerprints.json, images-index.json and every downloaded
+image. Exits with 1 and lists the differences if anything differs.
+
+    python3 scripts/check_sharded_export.py --workers 3 --products 250
+"""
+import argparse
+import hashlib
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from mock_store import MockStore, start_server
+
+WORKER = Path(__file__).resolve().parent.parent / "src" / "python_scraper.py"
+
+
+def run_worker(payload: Dict[str, Any]) -> Dict[str, Any]:
+    completed = subprocess.run(
+        [sys.executable, str(WORKER)],
+        input=json.dumps(payload),
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+    )
+    for line in reversed(completed.stdout.splitlines()):
+        event = json.loads(line)
+        if event.get("type") == "result":
+            return event["result"]
+        if event.get("type") == "error":
+            raise RuntimeError(f"{payload.get('mode', 'export')} run failed: {event.get('message')}")
+    raise RuntimeError(f"Worker exited with {completed.returncode} and no result:\n{completed.stderr}")
+
+
+def export_snapshot(export_dir: Path) -> Dict[str, Any]:
+    woo_dir = export_dir / "woocommerce"
+    metadata = json.loads((woo_dir / "metadata.json").read_text(encoding="utf-8"))
+    fingerprints = json.loads((woo_dir / "fingerprints.json").read_text(encoding="utf-8"))
+    products_dir = woo_dir / "products"
+    return {
+        "metadata.json products": metadata["products"],
+        "metadata.json total": metadata["total"],
+        "woocommerce-import.csv": (woo_dir / "woocommerce-import.csv").read_text(encoding="utf-8"),
+        "fingerprints.json products": fingerprints.get("products"),
+        "images-index.json": json.loads((woo_dir / "images-index.json").read_text(encoding="utf-8")),
+        "image files": {
+            path.relative_to(products_dir).as_posix(): hashlib.sha1(path.read_bytes()).hexdigest()
+            for path in sorted(products_dir.rglob("*"))
+            if path.is_file()
+        },
+    }
+
+
+def compare(single: Dict[str, Any], sharded: Dict[str, Any]) -> List[str]:
+    differences = []
+    for key, expected in single.items():
+        actual = sharded[key]
+        if actual == expected:
+            continue
+        if isinstance(expected, dict) and isinstance(actual, dict):
+            missing = sorted(set(expected) - set(actual))[:5]
+            extra = sorted(set(actual) - set(expected))[:5]
+            shared = set(expected) & set(actual)
+            changed = sorted(name for name in shared if expected[name] != actual[name])[:5]
+            differences.append(f"{key}: missing {missing}, extra {extra}, changed {changed}")
+        elif isinstance(expected, list) and isinstance(actual, list):
+            first = next(
+                (index for index, pair in enumerate(zip(expected, actual)) if pair[0] != pair[1]),
+                min(len(expected), len(actual)),
+            )
+            differences.append(
+                f"{key}: {len(expected)} vs {len(actual)} entries, first difference at {first}"
+            )
+        else:
+            differences.append(f"{key}: differs")
+    return differences
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--products", type=int, default=250)
+    parser.add_argument("--max-products", type=int, default=0, help="also pass maxProducts to both runs")
+    parser.add_argument("--keep", action="store_true", help="keep the export folders")
+    args = parser.parse_args()
+
+    server = start_server(MockStore(args.products))
+    url = f"http://127.0.0.1:{server.server_port}/"
+    work_dir = Path(tempfile.mkdtemp(prefix="woo-shard-check-"))
+    base = {"url": url, "maxProducts": args.max_products}
+    try:
+        started = time.monotonic()
+        run_worker({**base, "exportDir": str(work_dir / "single")})
+        single_seconds = time.monotonic() - started
+        started = time.monotonic()
+        run_worker(
+            {**base, "exportDir": str(work_dir / "sharded"), "mode": "coordinate", "workers": args.workers}
+        )
+        sharded_seconds = time.monotonic() - started
+
+        single = export_snapshot(work_dir / "single")
+        differences = compare(single, export_snapshot(work_dir / "sharded"))
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(
+        f"Single worker: {single_seconds:.1f}s; {args.workers} workers: {sharded_seconds:.1f}s; "
+        f"{len(single['metadata.json products'])} products, {len(single['image files'])} images."
+    )
+    if args.keep:
+        print(f"Exports kept in {work_dir}")
+    for difference in differences:
+        print(f"DIFFERENT {difference}")
+    print("Sharded export differs." if differences else "Sharded export matches the single-worker export.")
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""Local WooCommerce Store API mock for exercising the Python worker.
+
+Serves a deterministic catalog: paged products with X-WP-Total, variations for
+every third product, and small PNG images of varying size. Product and image
+URLs point back at the host the request came in on.
+
+    python3 scripts/mock_store.py --port 8765 --products 300
+    python3 scripts/mock_store.py --port 8843 --certfile cert.pem --keyfile key.pem --http2
+
+--http2 serves over hypercorn (`pip install hypercorn`), which negotiates h2
+over TLS; without it the stdlib server speaks HTTP/1.1 only.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import re
+import ssl
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = "/wp-json/wc/store/v1/products"
+VARIATIONS_PATH = re.compile(r"^/wp-json/wc/store/v1/products/(\d+)/variations$")
+IMAGE_PATH = re.compile(r"^/wp-content/uploads/(?:img|var)-(\d+)-(\d+)\.png$")
+
+Response = Tuple[int, Dict[str, str], bytes]
+
+
+def catalog_product(index: int, base: str) -> Dict[str, Any]:
+    variable = index % 3 == 0
+    variation_count = index % 7 + 1 if variable else 0
+    return {
+        "id": index,
+        "name": f"Product {index}",
+        "slug": f"product-{index}",
+        "type": "variable" if variable else "simple",
+        "permalink": f"{base}/product/product-{index}/",
+        "description": f"<p>Description of product {index}.</p>",
+        "short_description": f"<p>Product {index}.</p>",
+        "sku": f"SKU-{index}",
+        "prices": {
+            "price": str(1000 + index),
+            "regular_price": str(1200 + index),
+            "sale_price": str(1000 + index),
+            "currency_minor_unit": 2,
+        },
+        "categories": [{"id": index % 5, "name": f"Category {index % 5}", "slug": f"category-{index % 5}"}],
+        "tags": [],
+        "attributes": [
+            {
+                "id": 1,
+                "name": "Size",
+                "taxonomy": "pa_size",
+                "has_variations": True,
+                "terms": [{"id": 1, "name": "S", "slug": "s"}, {"id": 2, "name": "M", "slug": "m"}],
+            }
+        ]
+        if variable
+        else [],
+        "images": [
+            {"id": index * 10 + slot, "src": f"{base}/wp-content/uploads/img-{index}-{slot}.png", "alt": ""}
+            for slot in range(1 + index % 3)
+        ],
+        "has_options": variable,
+        "variations": [{"id": index * 1000 + number, "attributes": []} for number in range(variation_count)],
+        "is_in_stock": True,
+        "stock_status": "instock",
+    }
+
+
+def catalog_variation(product_id: int, number: int, base: str) -> Dict[str, Any]:
+    return {
+        "id": product_id * 1000 + number,
+        "name": f"Product {product_id} - {number}",
+        "sku": f"SKU-{product_id}-{number}",
+        "prices": {
+            "price": str(1000 + number),
+            "regular_price": str(1000 + number),
+            "sale_price": "",
+            "currency_minor_unit": 2,
+        },
+        "attributes": [{"name": "Size", "value": "S" if number % 2 else "M"}],
+        "image": {"src": f"{base}/wp-content/uploads/var-{product_id}-{number}.png"},
+        "is_in_stock": True,
+    }
+
+
+def png_image(width: int, height: int, seed: int) -> bytes:
+    # Noise rather than a flat fill, so the file size grows with the dimensions.
+    noise = random.Random(seed)
+    rows = b"".join(b"\x00" + noise.randbytes(width) for _ in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+class MockStore:
+    def __init__(self, products: int, latency: float = 0.0) -> None:
+        self.products = products
+        self.latency = latency
+        self.requests = 0
+        self._images: Dict[Tuple[int, int], bytes] = {}
+        self._lock = threading.Lock()
+
+    def image(self, owner: int, slot: int) -> bytes:
+        with self._lock:
+            cached = self._images.get((owner, slot))
+        if cached is None:
+            side = 64 + (owner * 7 + slot * 13) % 5 * 96
+            cached = png_image(side, side, owner * 10 + slot)
+            with self._lock:
+                self._images[(owner, slot)] = cached
+        return cached
+
+    def respond(self, method: str, target: str, headers: Dict[str, str], base: str) -> Response:
+        with self._lock:
+            self.requests += 1
+        url = urlparse(target)
+        query = parse_qs(url.query)
+        page = max(1, int(query.get("page", ["1"])[0]))
+        per_page = max(1, int(query.get("per_page", ["10"])[0]))
+        extra: Dict[str, str] = {}
+
+        match = VARIATIONS_PATH.match(url.path)
+        image = IMAGE_PATH.match(url.path)
+        if url.path == API_PREFIX:
+            ids = list(range(1, self.products + 1))
+            data: List[Dict[str, Any]] = [
+                catalog_product(index, base) for index in ids[(page - 1) * per_page : page * per_page]
+            ]
+            if "_fields" in query:
+                fields = set(query["_fields"][0].split(","))
+                data = [{key: value for key, value in item.items() if key in fields} for item in data]
+            extra["X-WP-Total"] = str(len(ids))
+            extra["X-WP-TotalPages"] = str(-(-len(ids) // per_page))
+            body, content_type = json.dumps(data).encode(), "application/json; charset=utf-8"
+        elif match and 1 <= int(match.group(1)) <= self.products:
+            product = catalog_product(int(match.group(1)), base)
+            variations = [
+                catalog_variation(product["id"], number, base) for number in range(len(product["variations"]))
+            ]
+            body = json.dumps(variations[(page - 1) * per_page : page * per_page]).encode()
+            content_type = "application/json; charset=utf-8"
+        elif image:
+            body, content_type = self.image(int(image.group(1)), int(image.group(2))), "image/png"
+        else:
+            return 404, {"Content-Type": "text/plain"}, b"Not found"
+
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if headers.get("if-none-match") == etag:
+            return 304, {"ETag": etag}, b""
+        if content_type.startswith("application/json") and "gzip" in headers.get("accept-encoding", ""):
+            body = gzip.compress(body, mtime=0)
+            extra["Content-Encoding"] = "gzip"
+        status = 200
+        ranged = re.match(r"bytes=(\d+)-(\d*)$", headers.get("range", ""))
+        if ranged and image:
+            start = int(ranged.group(1))
+            end = min(int(ranged.group(2) or len(body) - 1), len(body) - 1)
+            extra["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            body, status = body[start : end + 1], 206
+        extra.update({"Content-Type": content_type, "ETag": etag, "Content-Length": str(len(body))})
+        return status, extra, b"" if method == "HEAD" else body
+
+
+def make_handler(store: MockStore, scheme: str) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:
+            if store.latency:
+                time.sleep(store.latency)
+            headers = {key.lower(): value for key, value in self.headers.items()}
+            base = f"{scheme}://{self.headers.get('Host')}"
+            status, response_headers, body = store.respond(self.command, self.path, headers, base)
+            self.send_response(status)
+            for key, value in response_headers.items():
+                self.send_header(key, value)
+            if "Content-Length" not in response_headers:
+                self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_HEAD = do_GET
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+def start_server(
+    store: MockStore,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    certfile: Optional[str] = None,
+    keyfile: Optional[str] = None,
+) -> ThreadingHTTPServer:
+    """Serves HTTP/1.1 from a background thread; port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), make_handler(store, "https" if certfile else "http"))
+    server.daemon_threads = True
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_http2(store: MockStore, host: str, port: int, certfile: str, keyfile: str) -> None:
+    import asyncio
+
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    async def app(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            return
+        if store.latency:
+            await asyncio.sleep(store.latency)
+        headers = {key.decode().lower(): value.decode() for key, value in scope["headers"]}
+        target = scope["path"] + ("?" + scope["query_string"].decode() if scope["query_string"] else "")
+        base = f"{scope['scheme']}://{headers.get('host') or headers.get(':authority')}"
+        status, response_headers, body = store.respond(scope["method"], target, headers, base)
+        encoded = [(key.lower().encode(), value.encode()) for key, value in response_headers.items()]
+        await send({"type": "http.response.start", "status": status, "headers": encoded})
+        await send({"type": "http.response.body", "body": body})
+
+    config = Config()
+    config.bind = [f"{host}:{port}"]
+    config.certfile, config.keyfile = certfile, keyfile
+    config.alpn_protocols = ["h2", "http/1.1"]
+    config.accesslog = None
+    asyncio.run(serve(app, config))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--products", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--certfile")
+    parser.add_argument("--keyfile")
+    parser.add_argument("--http2", action="store_true", help="serve through hypercorn (needs TLS)")
+    args = parser.parse_args()
+
+    store = MockStore(args.products, args.latency)
+    if args.http2:
+        if not args.certfile:
+            parser.error("--http2 needs --certfile and --keyfile")
+        serve_http2(store, args.host, args.port, args.certfile, args.keyfile)
+        return 0
+    server = start_server(store, args.host, args.port, args.certfile, args.keyfile)
+    scheme = "https" if args.certfile else "http"
+    url = f"{scheme}://{args.host}:{server.server_port}/"
+    print(f"Mock store with {args.products} products at {url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,184 @@
 #!/usr/bin/env python3
 import csv
+import gc
+import gzip
 import hashlib
+import heapq
+import io
 import json
 import mimetypes
 import os
+import queue
 import re
+import shutil
+import sqlite3
 import ssl
+import struct
+import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
+import time
 import traceback
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import datetime
+from html import unescape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from urllib.error import HTTPError, URLError
 from urllib.parse import urljoin, urlparse
 from urllib.request import Request, urlopen
 
+try:
+    import zstandard
+except ImportError:  # optional: zstd output falls back to gzip without it
+    zstandard = None
+
+try:
+    import resource
+except ImportError:  # not available on Windows; RSS checks fall back to /proc or 0
+    resource = None
+
+try:
+    import brotli
+except ImportError:  # optional: br is only advertised when it can be decoded
+    brotli = None
+
+try:
+    import h2  # noqa: F401 - needed by httpx for HTTP/2
+    import httpx
+except ImportError:  # optional: the HTTP/2 transport falls back to urllib (HTTP/1.1)
+    httpx = None
+
 USER_AGENT = "Mozilla/5.0 (compatible; WooExportPython/1.0; +https://localhost)"
 REQUEST_TIMEOUT = 30
 PRODUCTS_PER_PAGE = 100
 ALLOW_INSECURE_TLS_FALLBACK = os.environ.get("PYTHON_SCRAPER_INSECURE_TLS", "1") != "0"
 _TLS_WARNING_EMITTED = False
+CPU_COUNT = os.cpu_count() or 4
+
+
+def read_positive_int_env(name: str, fallback: int) -> int:
+    try:
+        value = int(os.environ.get(name, ""))
+    except ValueError:
+        return fallback
+    return value if value >= 1 else fallback
+
+
+CSV_SHARD_ROWS = read_positive_int_env("PYTHON_SCRAPER_CSV_SHARD_ROWS", 0)
+CSV_SHARD_CONCURRENCY = read_positive_int_env(
+    "PYTHON_SCRAPER_CSV_SHARD_CONCURRENCY", min(4, max(2, CPU_COUNT))
+)
+OUTPUT_COMPRESSION = os.environ.get("PYTHON_SCRAPER_COMPRESS", "")
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+JSON_READ_CHUNK = 256 * 1024
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+BUNDLE_FORMAT = os.environ.get("PYTHON_SCRAPER_BUNDLE", "")
+BUNDLE_SUFFIXES = {"zip": ".zip", "tar": ".tar"}
+# Only text members are deflated; images and .gz/.zst files are already compressed.
+BUNDLE_DEFLATE_SUFFIXES = (".json", ".csv")
+HTTP_COMPRESSION = os.environ.get("PYTHON_SCRAPER_HTTP_COMPRESSION", "1") != "0"
+HTTP2 = os.environ.get("PYTHON_SCRAPER_HTTP2") == "1"
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+TRIM_FIELDS = os.environ.get("PYTHON_SCRAPER_TRIM_FIELDS") == "1"
+# Only the keys read by simplify_product / simplify_variation (and the CSV builder).
+PRODUCT_FIELDS = (
+    "id,name,slug,type,permalink,description,short_description,sku,stock_status,"
+    "catalog_visibility,tax_status,is_featured,is_in_stock,prices,categories,tags,"
+    "attributes,images,has_options,variations"
+)
+VARIATION_FIELDS = (
+    "id,name,sku,description,stock_status,is_in_stock,tax_status,prices,attributes,"
+    "image,images,price,regular_price,sale_price,currency_minor_unit"
+)
+
+CACHE_DIR = os.environ.get("PYTHON_SCRAPER_CACHE_DIR", "")
+CACHE_TTL_SECONDS = read_positive_int_env("PYTHON_SCRAPER_CACHE_TTL", 3600)
+CACHE_MAX_MB = read_positive_int_env("PYTHON_SCRAPER_CACHE_MAX_MB", 512)
+CACHE_STALE_TMP_SECONDS = 300
+SHARD_WORKERS = read_positive_int_env("PYTHON_SCRAPER_SHARD_WORKERS", 2)
+IMAGE_CONCURRENCY = read_positive_int_env(
+    "PYTHON_SCRAPER_IMAGE_CONCURRENCY", min(16, max(6, CPU_COUNT * 2))
+)
+VARIATION_CONCURRENCY = read_positive_int_env(
+    "PYTHON_SCRAPER_VARIATION_CONCURRENCY", min(8, max(3, CPU_COUNT))
+)
+SCHEDULE = os.environ.get("PYTHON_SCRAPER_SCHEDULE", "ljf")
+SCHEDULE_WINDOW = 1024
+VARIATION_SOURCE = os.environ.get("PYTHON_SCRAPER_VARIATION_SOURCE", "auto")
+IMAGE_BANDWIDTH_KBPS = read_positive_int_env("PYTHON_SCRAPER_IMAGE_BANDWIDTH_KBPS", 0)
+IMAGE_HOST_BANDWIDTH_KBPS = read_positive_int_env("PYTHON_SCRAPER_IMAGE_HOST_BANDWIDTH_KBPS", 0)
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+IMAGE_PREFLIGHT = os.environ.get("PYTHON_SCRAPER_IMAGE_PREFLIGHT") == "1"
+IMAGE_MAX_KB = read_positive_int_env("PYTHON_SCRAPER_IMAGE_MAX_KB", 0)
+IMAGE_MAX_DIMENSION = read_positive_int_env("PYTHON_SCRAPER_IMAGE_MAX_DIMENSION", 0)
+IMAGE_TYPES = os.environ.get("PYTHON_SCRAPER_IMAGE_TYPES", "")
+# Enough for the JPEG frame header in files with large EXIF blocks.
+IMAGE_PROBE_BYTES = 64 * 1024
+# WordPress intermediate sizes (photo-300x300.jpg) and big-image copies (photo-scaled.jpg).
+WP_IMAGE_SIZE_SUFFIX = re.compile(r"-(?:(\d+)x(\d+)|scaled)(?=\.[A-Za-z0-9]+$)")
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+ESTIMATE_SAMPLE_PAGES = read_positive_int_env("PYTHON_SCRAPER_ESTIMATE_SAMPLE_PAGES", 3)
+ESTIMATE_SAMPLE_VARIATIONS = read_positive_int_env("PYTHON_SCRAPER_ESTIMATE_SAMPLE_VARIATIONS", 5)
+ESTIMATE_HEAD_IMAGES = read_positive_int_env("PYTHON_SCRAPER_ESTIMATE_HEAD_IMAGES", 0)
+AUTOTUNE = os.environ.get("PYTHON_SCRAPER_AUTOTUNE") == "1"
+PAGE_CONCURRENCY = read_positive_int_env("PYTHON_SCRAPER_PAGE_CONCURRENCY", 8)
+# Store API page sizes to probe; each divides the next, so probe ranges stay aligned.
+AUTOTUNE_PAGE_SIZES = (25, 50, PRODUCTS_PER_PAGE)
+AUTOTUNE_SECONDS = 10
+AUTOTUNE_MIN_GAIN = 1.15
+TRACE = os.environ.get("PYTHON_SCRAPER_TRACE") == "1"
+PROGRESS_THROTTLE_MS = read_positive_int_env("PYTHON_SCRAPER_PROGRESS_THROTTLE_MS", 250)
+PROGRESS_RATE_WINDOW_SECONDS = 10
+METRICS_PORT = read_positive_int_env("PYTHON_SCRAPER_METRICS_PORT", 0)
+METRICS_HOST = os.environ.get("PYTHON_SCRAPER_METRICS_HOST", "127.0.0.1")
+METRICS_FILE = os.environ.get("PYTHON_SCRAPER_METRICS_FILE", "")
+METRICS_INTERVAL_SECONDS = read_positive_int_env("PYTHON_SCRAPER_METRICS_INTERVAL", 5)
+METRICS_PREFIX = "woo_export"
+REQUEST_DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+HEDGE_REQUESTS = os.environ.get("PYTHON_SCRAPER_HEDGE") == "1"
+HEDGE_PERCENTILE = read_positive_int_env("PYTHON_SCRAPER_HEDGE_PERCENTILE", 95)
+HEDGE_MAX_RATE = read_positive_int_env("PYTHON_SCRAPER_HEDGE_MAX_RATE", 5)
+HEDGE_MIN_MS = read_positive_int_env("PYTHON_SCRAPER_HEDGE_MIN_MS", 50)
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 500
+MEMORY_BOUNDED = os.environ.get("PYTHON_SCRAPER_MEMORY_BOUNDED") == "1"
+MEMORY_LIMIT_MB = read_positive_int_env("PYTHON_SCRAPER_MEMORY_LIMIT_MB", 1024)
+MEMORY_WAIT_MS = read_positive_int_env("PYTHON_SCRAPER_MEMORY_WAIT_MS", 2000)
+SPILL_QUEUE_PAGES = 4
+SPILL_COMMIT_EVERY = 200
+CATALOG_DB = os.environ.get("PYTHON_SCRAPER_CATALOG_DB") == "1"
+CATALOG_COMMIT_EVERY = 500
+STAGE_ORDER = ["scanning_products", "processing_variations", "downloading_images", "completed"]
+
+_EMIT_LOCK = threading.Lock()
+_STATS_LOCK = threading.Lock()
+_NETWORK_STATS: Dict[str, int] = {}
+_RESPONSE_CACHE: Optional["ResponseCache"] = None
+_BANDWIDTH_BUDGET: Optional["BandwidthBudget"] = None
+_HEDGER: Optional["Hedger"] = None
+_HTTP2: Optional["Http2Transport"] = None
+_TRACER: Optional["Tracer"] = None
+_TRACE_CONTEXT = threading.local()
+_HEDGE_CONTEXT = threading.local()
+_PROGRESS: Optional["ProgressReporter"] = None
+_METRICS: Optional["MetricsRegistry"] = None
+_METRICS_EXPORTER: Optional["MetricsExporter"] = None
 
 
 def emit(payload: Dict[str, Any]) -> None:
-    sys.stdout.write(json.dumps(payload, ensure_ascii=False) + "\n")
-    sys.stdout.flush()
+    line = json.dumps(payload, ensure_ascii=False) + "\n"
+    with _EMIT_LOCK:
+        sys.stdout.write(line)
+        sys.stdout.flush()
 
 
 def emit_log(message: str) -> None:
@@ -32,9 +186,121 @@ def emit_log(message: str) -> None:
 
 
 def emit_progress(patch: Dict[str, Any]) -> None:
+    reporter = _PROGRESS
+    if reporter is not None:
+        reporter.update(patch)
+        return
     emit({"type": "progress", "patch": patch})
 
 
+class ProgressReporter:
+    """Throttles progress events and adds rolling rates and an ETA for the current stage."""
+
+    def __init__(self, throttle_ms: int, products_target: int) -> None:
+        self.throttle = throttle_ms / 1000
+        self.products_target = products_target
+        self.state: Dict[str, Any] = {}
+        self.samples: deque = deque()
+        self.last_emit = 0.0
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def counters(self) -> Tuple[int, int, int, int, int]:
+        stats = network_stats()
+        return (
+            int(self.state.get("productsDiscovered") or 0),
+            int(self.state.get("variationProductsProcessed") or 0),
+            int(self.state.get("imagesDownloaded") or 0) + int(self.state.get("imagesSkipped") or 0),
+            int(self.state.get("productsProcessed") or 0),
+            stats.get("downloadBytes", 0) + stats.get("apiBytesOnWire", 0),
+        )
+
+    def update(self, patch: Dict[str, Any]) -> None:
+        with self._lock:
+            stage_changed = patch.get("stage") != self.state.get("stage")
+            self.state.update(patch)
+            now = time.monotonic()
+            if stage_changed:
+                self.samples.clear()
+            self.samples.append((now, self.counters()))
+            while len(self.samples) > 2 and now - self.samples[0][0] > PROGRESS_RATE_WINDOW_SECONDS:
+                self.samples.popleft()
+            if stage_changed or now - self.last_emit >= self.throttle:
+                self._flush(now)
+            else:
+                self.dirty = True
+
+    def rates(self) -> List[float]:
+        if len(self.samples) < 2:
+            return [0.0] * 5
+        (first_time, first), (last_time, last) = self.samples[0], self.samples[-1]
+        elapsed = last_time - first_time
+        if elapsed <= 0:
+            return [0.0] * 5
+        return [(after - before) / elapsed for before, after in zip(first, last)]
+
+    def eta_seconds(self, rates: List[float]) -> Optional[int]:
+        state = self.state
+        stage = state.get("stage")
+        remaining, rate = 0, 0.0
+        if stage == "scanning_products":
+            target = self.products_target or int(state.get("productsTotal") or 0)
+            if target <= 0:
+                return None
+            remaining, rate = target - int(state.get("productsDiscovered") or 0), rates[0]
+        elif stage == "processing_variations":
+            remaining = int(state.get("variationProductsTotal") or 0) - int(
+                state.get("variationProductsProcessed") or 0
+            )
+            rate = rates[1]
+        elif stage == "downloading_images":
+            if state.get("imagesTotal"):
+                remaining = int(state["imagesTotal"]) - int(state.get("imagesDownloaded") or 0) - int(
+                    state.get("imagesSkipped") or 0
+                )
+                rate = rates[2]
+            else:
+                remaining = int(state.get("productsDiscovered") or 0) - int(
+                    state.get("productsProcessed") or 0
+                )
+                rate = rates[3]
+        elif stage == "completed":
+            return 0
+        else:
+            return None
+        if remaining <= 0:
+            return 0
+        return int(remaining / rate) if rate > 0 else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        rates = self.rates()
+        return {
+            **self.state,
+            "productsPerSecond": round(rates[0], 2),
+            "variationProductsPerSecond": round(rates[1], 2),
+            "imagesPerSecond": round(rates[2], 2),
+            "mbPerSecond": round(rates[4] / (1024 * 1024), 2),
+            "etaSeconds": self.eta_seconds(rates),
+        }
+
+    def _flush(self, now: float) -> None:
+        emit({"type": "progress", "patch": self.snapshot()})
+        self.last_emit = now
+        self.dirty = False
+
+    def close(self) -> None:
+        with self._lock:
+            if self.dirty:
+                self._flush(time.monotonic())
+
+
+def configure_progress(reporter: Optional[ProgressReporter]) -> None:
+    global _PROGRESS
+    if _PROGRESS is not None:
+        _PROGRESS.close()
+    _PROGRESS = reporter
+
+
 def read_input_payload() -> Dict[str, Any]:
     raw = sys.stdin.read().strip()
     if not raw:
@@ -57,6 +323,15 @@ def has_content(value: Any) -> bool:
     return str(value).strip() != ""
 
 
+def read_int_option(payload: Dict[str, Any], key: str, fallback: int) -> int:
+    if not has_content(payload.get(key)):
+        return fallback
+    try:
+        return max(0, int(payload.get(key)))
+    except Exception:
+        return fallback
+
+
 def sanitize_segment(value: Any) -> str:
     text = str(value or "").strip()
     text = re.sub(r"[^a-zA-Z0-9._-]+", "-", text)
@@ -82,55 +357,1008 @@ def to_absolute_url(url_like: Any, site_root: str) -> str:
         return ""
 
 
-def request_bytes(url: str) -> Tuple[bytes, Dict[str, str]]:
-    req = Request(
-        url,
-        headers={
-            "User-Agent": USER_AGENT,
-            "Accept": "*/*",
-        },
-    )
+def record_stat(key: str, amount: int = 1) -> None:
+    with _STATS_LOCK:
+        _NETWORK_STATS[key] = _NETWORK_STATS.get(key, 0) + amount
+
+
+def network_stats() -> Dict[str, int]:
+    with _STATS_LOCK:
+        return dict(_NETWORK_STATS)
+
+
+class Tracer:
+    """Streams Chrome trace-event JSON (complete "X" events) to a file."""
+
+    STAGE_TID = 0
+    # The wall-clock start lets merge_shard_traces line up traces from several workers.
+    HEADER = '{"displayTimeUnit": "ms", "otherData": {"startTime": %.6f}, "traceEvents": [\n'
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self.handle = path.open("w", encoding="utf-8")
+        self.handle.write(self.HEADER % time.time())
+        self.count = 0
+        self.threads: Dict[int, int] = {}
+        self.stage: Optional[Tuple[str, float]] = None
+        self._lock = threading.Lock()
+        self._write({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": self.STAGE_TID,
+                     "args": {"name": "stages"}})
+
+    def _write(self, event: Dict[str, Any]) -> None:
+        # Callers hold the lock (or are still in __init__).
+        self.handle.write((",\n" if self.count else "") + json.dumps(event, ensure_ascii=False))
+        self.count += 1
+
+    def _tid(self) -> int:
+        ident = threading.get_ident()
+        tid = self.threads.get(ident)
+        if tid is None:
+            tid = self.threads[ident] = len(self.threads) + 1
+            self._write({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                         "args": {"name": threading.current_thread().name}})
+        return tid
+
+    def _micros(self, moment: float) -> int:
+        return int((moment - self.origin) * 1_000_000)
+
+    def complete(
+        self, name: str, category: str, started: float, finished: float, args: Dict[str, Any],
+        tid: Optional[int] = None,
+    ) -> None:
+        with self._lock:
+            self._write(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": self._micros(started),
+                    "dur": max(0, self._micros(finished) - self._micros(started)),
+                    "pid": self.pid,
+                    "tid": self._tid() if tid is None else tid,
+                    "args": args,
+                }
+            )
+
+    def instant(self, name: str, category: str, args: Dict[str, Any]) -> None:
+        with self._lock:
+            self._write(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "i",
+                    "s": "t",
+                    "ts": self._micros(time.perf_counter()),
+                    "pid": self.pid,
+                    "tid": self._tid(),
+                    "args": args,
+                }
+            )
+
+    def begin_stage(self, name: Optional[str]) -> None:
+        # Stages are sequential: starting one ends the previous one.
+        now = time.perf_counter()
+        if self.stage is not None:
+            self.complete(self.stage[0], "stage", self.stage[1], now, {}, self.STAGE_TID)
+        self.stage = (name, now) if name else None
+
+    def close(self) -> None:
+        self.begin_stage(None)
+        with self._lock:
+            self.handle.write("\n]}\n")
+            self.handle.close()
+
+
+def configure_tracing(path: Optional[Path]) -> None:
+    global _TRACER
+    if _TRACER is not None:
+        _TRACER.close()
+    _TRACER = Tracer(path) if path is not None else None
+
+
+@contextmanager
+def trace_span(name: str, category: str, **args: Any) -> Iterator[None]:
+    # Also feeds the request duration histogram when metrics are enabled.
+    tracer = _TRACER
+    metrics = _METRICS
+    if tracer is None and metrics is None:
+        yield
+        return
+    stack = getattr(_TRACE_CONTEXT, "spans", None)
+    if stack is None:
+        stack = _TRACE_CONTEXT.spans = []
+    stack.append(args)
+    started = time.perf_counter()
     try:
-        with open_with_tls_fallback(req) as response:
-            body = response.read()
-            headers = {k.lower(): v for k, v in response.headers.items()}
-            return body, headers
-    except HTTPError as exc:
-        detail = ""
+        yield
+    except BaseException as exc:
+        args.setdefault("error", str(exc)[:200])
+        raise
+    finally:
+        stack.pop()
+        finished = time.perf_counter()
+        if tracer is not None:
+            tracer.complete(name, category, started, finished, args)
+        if metrics is not None and category == "http":
+            metrics.observe_request(name, finished - started, "error" in args)
+
+
+def annotate_span(**fields: Any) -> None:
+    stack = getattr(_TRACE_CONTEXT, "spans", None)
+    if stack:
+        for key, value in fields.items():
+            stack[-1][key] = stack[-1].get(key, 0) + value if key == "retries" else value
+
+
+def trace_stage(name: Optional[str]) -> None:
+    if _TRACER is not None:
+        _TRACER.begin_stage(name)
+    if _METRICS is not None:
+        _METRICS.begin_stage(name)
+
+
+def note_retry(**fields: Any) -> None:
+    record_stat("requestRetries")
+    annotate_span(retries=1, **fields)
+
+
+def request_kind(url: str) -> str:
+    path = urlparse(url).path
+    if path.endswith("/variations"):
+        return "api.variations"
+    if "/wc/store/" in path:
+        return "api.products"
+    return "api"
+
+
+class MetricsRegistry:
+    """Request histograms, gauges and stage timings, rendered with the network
+    counters and the latest progress as OpenMetrics text."""
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.requests: Dict[str, List[Any]] = {}
+        self.failures: Dict[str, int] = {}
+        self.gauges: Dict[Tuple[str, str], float] = {}
+        self.stages: Dict[str, List[float]] = {}
+        self.stage: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def observe_request(self, kind: str, seconds: float, failed: bool) -> None:
+        with self._lock:
+            entry = self.requests.get(kind)
+            if entry is None:
+                entry = self.requests[kind] = [[0] * len(REQUEST_DURATION_BUCKETS), 0, 0.0]
+            for index, bound in enumerate(REQUEST_DURATION_BUCKETS):
+                if seconds <= bound:
+                    entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += seconds
+            if failed:
+                self.failures[kind] = self.failures.get(kind, 0) + 1
+
+    def add_gauge(self, name: str, pool: str, delta: float) -> None:
+        with self._lock:
+            self.gauges[(name, pool)] = self.gauges.get((name, pool), 0) + delta
+
+    def set_gauge(self, name: str, pool: str, value: float) -> None:
+        with self._lock:
+            self.gauges[(name, pool)] = value
+
+    def run_pooled(self, pool: str, fn: Callable[..., Any], *args: Any) -> Any:
+        self.add_gauge("pool_queued", pool, -1)
+        self.add_gauge("pool_busy", pool, 1)
         try:
-            detail = exc.read().decode("utf-8", errors="replace")[:200]
-        except Exception:
+            return fn(*args)
+        finally:
+            self.add_gauge("pool_busy", pool, -1)
+
+    def begin_stage(self, name: Optional[str]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self.stage is not None:
+                self.stages[self.stage][1] = now
+            self.stage = name
+            if name is not None:
+                self.stages[name] = [now, 0.0]
+
+    def render(self) -> str:
+        prefix = METRICS_PREFIX
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+
+        family("start_time_seconds", "gauge", "Unix time the job started.")
+        lines.append(f"{prefix}_start_time_seconds {self.started:.3f}")
+
+        for key, value in sorted({"requestRetries": 0, **network_stats()}.items()):
+            name = re.sub(r"(?<!^)(?=[A-Z])", "_", key).lower()
+            if name.endswith("_ms"):
+                name, value = name[:-3] + "_seconds", value / 1000
+            family(name, "counter", f"{key} counter of the worker.")
+            lines.append(f"{prefix}_{name}_total {value}")
+
+        reporter = _PROGRESS
+        if reporter is not None:
+            with reporter._lock:
+                snapshot = reporter.snapshot()
+            for key, value in sorted(snapshot.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = re.sub(r"(?<!^)(?=[A-Z])", "_", key).lower()
+                    family(f"progress_{name}", "gauge", f"Latest {key} progress value.")
+                    lines.append(f"{prefix}_progress_{name} {value}")
+
+        with self._lock:
+            now = time.monotonic()
+            family("stage", "gauge", "1 for the stage the job is in.")
+            for stage in self.stages:
+                lines.append(f'{prefix}_stage{{stage="{stage}"}} {1 if stage == self.stage else 0}')
+            family("stage_duration_seconds", "gauge", "Time spent in each stage so far.")
+            for stage, (started, finished) in self.stages.items():
+                elapsed = (finished or now) - started
+                lines.append(f'{prefix}_stage_duration_seconds{{stage="{stage}"}} {elapsed:.3f}')
+
+            family("pool_workers", "gauge", "Threads in each worker pool.")
+            family("pool_busy", "gauge", "Pool threads running a job.")
+            family("pool_queued", "gauge", "Jobs submitted to a pool and waiting for a thread.")
+            family("queue_depth", "gauge", "Items waiting in a hand-over queue.")
+            by_family: Dict[str, List[str]] = {}
+            for (name, pool), value in sorted(self.gauges.items()):
+                label = "queue" if name == "queue_depth" else "pool"
+                by_family.setdefault(name, []).append(f'{prefix}_{name}{{{label}="{pool}"}} {value:g}')
+            for name in ("pool_workers", "pool_busy", "pool_queued", "queue_depth"):
+                index = lines.index(f"# TYPE {prefix}_{name} gauge") + 2
+                lines[index:index] = by_family.get(name, [])
+
+            family("request_duration_seconds", "histogram", "HTTP request latency by request kind.")
+            histogram = f"{prefix}_request_duration_seconds"
+            for kind, (buckets, count, total) in sorted(self.requests.items()):
+                for bound, bucket in zip(REQUEST_DURATION_BUCKETS, buckets):
+                    lines.append(f'{histogram}_bucket{{kind="{kind}",le="{bound}"}} {bucket}')
+                lines.append(f'{histogram}_bucket{{kind="{kind}",le="+Inf"}} {count}')
+                lines.append(f'{histogram}_count{{kind="{kind}"}} {count}')
+                lines.append(f'{histogram}_sum{{kind="{kind}"}} {total:.6f}')
+            family("request_failures", "counter", "HTTP requests that raised, by request kind.")
+            for kind, count in sorted(self.failures.items()):
+                lines.append(f'{prefix}_request_failures_total{{kind="{kind}"}} {count}')
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class MetricsExporter:
+    """Serves the registry over HTTP and/or rewrites a .prom file on an interval."""
+
+    def __init__(
+        self, registry: MetricsRegistry, host: str, port: int, path: Optional[Path], interval: int
+    ) -> None:
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.threads: List[threading.Thread] = []
+        if port:
+            try:
+                self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+            except OSError as exc:
+                emit_log(f"Metrics endpoint disabled: cannot listen on {host}:{port} ({exc}).")
+            else:
+                self.server.daemon_threads = True
+                self.server.registry = registry
+                self.threads.append(threading.Thread(target=self.server.serve_forever, daemon=True))
+                emit_log(f"Metrics endpoint: http://{host}:{port}/metrics")
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.threads.append(threading.Thread(target=self._write_loop, daemon=True))
+            emit_log(f"Metrics file: {path} (every {interval}s)")
+        for thread in self.threads:
+            thread.start()
+
+    def write_file(self) -> None:
+        # Written beside the target and renamed, so scrapers never see half a file.
+        partial = self.path.with_name(self.path.name + ".tmp")
+        partial.write_text(self.registry.render(), encoding="utf-8")
+        os.replace(partial, self.path)
+
+    def _write_loop(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write_file()
+            except OSError as exc:
+                emit_log(f"Metrics file write failed: {exc}")
+
+    def close(self) -> None:
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self.threads:
+            thread.join()
+        if self.path is not None:
+            self.write_file()
+
+
+def configure_metrics(host: str, port: int, path: Optional[Path], interval: int) -> None:
+    global _METRICS, _METRICS_EXPORTER
+    if _METRICS_EXPORTER is not None:
+        _METRICS.begin_stage(None)
+        _METRICS_EXPORTER.close()
+    _METRICS = _METRICS_EXPORTER = None
+    if port or path is not None:
+        _METRICS = MetricsRegistry()
+        _METRICS_EXPORTER = MetricsExporter(_METRICS, host, port, path, interval)
+
+
+def set_pool_size(pool: str, workers: int) -> None:
+    if _METRICS is not None:
+        _METRICS.set_gauge("pool_workers", pool, workers)
+        _METRICS.set_gauge("pool_queued", pool, 0)
+
+
+def submit_pooled(
+    pool: ThreadPoolExecutor, name: str, fn: Callable[..., Any], *args: Any
+) -> "Future[Any]":
+    # A named pool reports its queued and busy jobs to the metrics registry.
+    metrics = _METRICS
+    if metrics is None or not name:
+        return pool.submit(fn, *args)
+    metrics.add_gauge("pool_queued", name, 1)
+    return pool.submit(metrics.run_pooled, name, fn, *args)
+
+
+def decode_content(body: bytes, content_encoding: Any) -> bytes:
+    encoding = str(content_encoding or "").strip().lower()
+    if encoding in ("", "identity"):
+        return body
+    if encoding in ("gzip", "x-gzip"):
+        return gzip.decompress(body)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    if encoding == "br" and brotli is not None:
+        return brotli.decompress(body)
+    raise RuntimeError(f"Unsupported Content-Encoding: {encoding}")
+
+
+class ByteRateLimiter:
+    """Token bucket in bytes. Callers may overdraw; they then sleep off the debt."""
+
+    def __init__(self, bytes_per_second: int) -> None:
+        self.rate = float(bytes_per_second)
+        self.capacity = max(float(bytes_per_second), float(DOWNLOAD_CHUNK_BYTES))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class BandwidthBudget:
+    def __init__(self, global_bytes_per_second: int, host_bytes_per_second: int) -> None:
+        self.global_limiter = (
+            ByteRateLimiter(global_bytes_per_second) if global_bytes_per_second > 0 else None
+        )
+        self.host_bytes_per_second = host_bytes_per_second
+        self.host_limiters: Dict[str, ByteRateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def limiter_for_host(self, host: str) -> Optional[ByteRateLimiter]:
+        if self.host_bytes_per_second <= 0:
+            return None
+        with self._lock:
+            if host not in self.host_limiters:
+                self.host_limiters[host] = ByteRateLimiter(self.host_bytes_per_second)
+            return self.host_limiters[host]
+
+    def consume(self, host: str, amount: int) -> None:
+        wait = 0.0
+        for limiter in (self.limiter_for_host(host), self.global_limiter):
+            if limiter is not None:
+                wait = max(wait, limiter.reserve(amount))
+        if wait > 0:
+            record_stat("bandwidthWaitMs", int(wait * 1000))
+            time.sleep(wait)
+
+
+def configure_bandwidth_budget(global_kbps: int, host_kbps: int) -> None:
+    global _BANDWIDTH_BUDGET
+    if global_kbps <= 0 and host_kbps <= 0:
+        _BANDWIDTH_BUDGET = None
+        return
+    _BANDWIDTH_BUDGET = BandwidthBudget(global_kbps * 1024, host_kbps * 1024)
+
+
+class Hedger:
+    """Issues a duplicate request when one runs past a latency percentile."""
+
+    def __init__(self, percentile: int, max_rate_percent: int, min_ms: int, workers: int) -> None:
+        self.percentile = min(99, max(50, percentile))
+        self.max_rate = max_rate_percent / 100
+        self.min_seconds = min_ms / 1000
+        # Primaries get their own pool, so a burst of hedges can never queue
+        # the original requests behind them.
+        self.primaries = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hedge-primary")
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hedge")
+        self.samples: Dict[str, deque] = {}
+        self.calls = 0
+        self.issued = 0
+        self._lock = threading.Lock()
+
+    def threshold(self, kind: str) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self.samples.get(kind) or ())
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(self.min_seconds, samples[min(len(samples) - 1, len(samples) * self.percentile // 100)])
+
+    def observe(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            self.samples.setdefault(kind, deque(maxlen=HEDGE_WINDOW)).append(seconds)
+
+    def allow_hedge(self) -> bool:
+        with self._lock:
+            if self.issued + 1 > self.calls * self.max_rate:
+                return False
+            self.issued += 1
+            return True
+
+    @staticmethod
+    def guarded(attempt: Callable[[int], Any], index: int, cancelled: threading.Event) -> Any:
+        _HEDGE_CONTEXT.cancelled = cancelled
+        try:
+            return attempt(index)
+        finally:
+            _HEDGE_CONTEXT.cancelled = None
+
+    def run(
+        self,
+        kind: str,
+        attempt: Callable[[int], Any],
+        discard: Optional[Callable[[Any], None]] = None,
+    ) -> Any:
+        # `attempt(0)` is the original request and `attempt(1)` the hedge. Only
+        # the original's own latency, failed or not, feeds the percentile. The
+        # loser is told to stop (see hedge_cancelled) and `discard` cleans up
+        # its result if it still finishes.
+        with self._lock:
+            self.calls += 1
+        started = time.monotonic()
+        threshold = self.threshold(kind)
+        if threshold is None:
+            try:
+                return attempt(0)
+            finally:
+                self.observe(kind, time.monotonic() - started)
+
+        cancel_primary, cancel_hedge = threading.Event(), threading.Event()
+        primary = self.primaries.submit(self.guarded, attempt, 0, cancel_primary)
+        primary.add_done_callback(lambda _: self.observe(kind, time.monotonic() - started))
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self.allow_hedge():
+            return primary.result()
+
+        record_stat("hedgesIssued")
+        if _TRACER is not None:
+            _TRACER.instant("hedge", "http", {"kind": kind, "thresholdMs": int(threshold * 1000)})
+        hedge = self.pool.submit(self.guarded, attempt, 1, cancel_hedge)
+        pending = {primary, hedge}
+        winner: Optional["Future[Any]"] = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if winner is None and future.exception() is None:
+                    winner = future
+        if winner is None:
+            return primary.result()
+
+        if winner is hedge:
+            record_stat("hedgesWon")
+        loser = primary if winner is hedge else hedge
+        (cancel_primary if loser is primary else cancel_hedge).set()
+        if discard is not None:
+
+            def cleanup(future: "Future[Any]") -> None:
+                if future.exception() is None:
+                    discard(future.result())
+
+            loser.add_done_callback(cleanup)
+        return winner.result()
+
+    def thresholds_ms(self) -> Dict[str, int]:
+        result: Dict[str, int] = {}
+        for kind in list(self.samples):
+            threshold = self.threshold(kind)
+            if threshold is not None:
+                result[kind] = int(threshold * 1000)
+        return result
+
+    def close(self) -> None:
+        for pool in (self.primaries, self.pool):
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def hedge_cancelled() -> bool:
+    # True inside a hedged attempt whose twin has already won.
+    cancelled = getattr(_HEDGE_CONTEXT, "cancelled", None)
+    return cancelled is not None and cancelled.is_set()
+
+
+def configure_hedging(
+    enabled: bool, percentile: int, max_rate_percent: int, min_ms: int, workers: int
+) -> None:
+    global _HEDGER
+    if _HEDGER is not None:
+        _HEDGER.close()
+    _HEDGER = Hedger(percentile, max_rate_percent, min_ms, workers) if enabled else None
+
+
+class Http2Response:
+    """urlopen-style view of a streamed httpx response; the body is read still encoded."""
+
+    def __init__(self, transport: "Http2Transport", req: Request, verify: bool, response: Any) -> None:
+        self.transport = transport
+        self.req = req
+        self.verify = verify
+        self.response = response
+        self.status = response.status_code
+        self.headers = response.headers
+        self.chunks = self.iter_chunks()
+        # Part of a chunk left over from a read(amount) shorter than the chunk.
+        self.leftover = b""
+
+    # Headers that must be unchanged before a retried body is spliced onto the
+    # bytes already handed out.
+    VALIDATORS = ("content-length", "content-range", "etag", "last-modified", "content-encoding")
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        # A connection closed under a running stream is retried once; the bytes
+        # already handed out are skipped in the new response. If the resource
+        # changed in between, the download fails and starts again from zero.
+        delivered = 0
+        retried = False
+        while True:
+            skip = delivered
+            try:
+                for chunk in self.response.iter_raw(DOWNLOAD_CHUNK_BYTES):
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk = chunk[dropped:]
+                        skip -= dropped
+                        if not chunk:
+                            continue
+                    delivered += len(chunk)
+                    yield chunk
+                return
+            except Http2Transport.RETRYABLE:
+                if retried:
+                    raise
+                retried = True
+                self.response.close()
+                note_retry()
+                self.response = self.transport.send(self.req, self.verify)
+                if self.response.status_code != self.status or any(
+                    self.response.headers.get(name) != self.headers.get(name) for name in self.VALIDATORS
+                ):
+                    self.response.close()
+                    raise httpx.RemoteProtocolError(
+                        f"{self.req.full_url} changed while its stream was retried"
+                    )
+
+    def read(self, amount: Optional[int] = None) -> bytes:
+        # Like urlopen, returns at most `amount` bytes and b"" at the end of the body.
+        try:
+            if amount is None or amount < 0:
+                data, self.leftover = self.leftover + b"".join(self.chunks), b""
+                return data
+            while not self.leftover:
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    return b""
+                self.leftover = chunk
+            data, self.leftover = self.leftover[:amount], self.leftover[amount:]
+            return data
+        except httpx.HTTPError as exc:
+            raise URLError(exc) from exc
+
+    def __enter__(self) -> "Http2Response":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.response.close()
+
+
+class Http2Transport:
+    """Shared httpx clients used in place of urlopen.
+
+    Requests to a host that negotiates h2 are multiplexed over one connection;
+    other hosts (and plain http://) get pooled HTTP/1.1 keep-alive connections.
+    Errors are raised as HTTPError / URLError so callers handle both transports
+    the same way.
+    """
+
+    # Servers close HTTP/2 connections after a request quota (GOAWAY; nginx
+    # defaults to 1000 requests), failing the streams still open on them. Every
+    # request here is a GET or HEAD, so these are retried once on a new connection.
+    RETRYABLE: Tuple[type, ...] = (
+        (httpx.RemoteProtocolError, httpx.ReadError, httpx.WriteError) if httpx is not None else ()
+    )
+
+    def __init__(self, max_connections: int) -> None:
+        self.limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        )
+        self.lock = threading.Lock()
+        self.clients: Dict[bool, Any] = {}
+        # Hosts that failed verification go straight to the insecure client.
+        self.insecure_hosts: set = set()
+
+    def client(self, verify: bool) -> Any:
+        with self.lock:
+            if verify not in self.clients:
+                self.clients[verify] = httpx.Client(
+                    http2=True,
+                    verify=verify,
+                    timeout=REQUEST_TIMEOUT,
+                    follow_redirects=True,
+                    limits=self.limits,
+                )
+            return self.clients[verify]
+
+    def send(self, req: Request, verify: bool) -> Any:
+        headers = dict(req.header_items())
+        if not any(name.lower() == "accept-encoding" for name in headers):
+            # httpx would advertise its own encodings; urllib sends none.
+            headers["Accept-Encoding"] = "identity"
+        client = self.client(verify)
+        request = client.build_request(req.get_method(), req.full_url, headers=headers)
+        try:
+            return client.send(request, stream=True)
+        except self.RETRYABLE:
+            note_retry()
+            return client.send(request, stream=True)
+
+    def open(self, req: Request) -> Http2Response:
+        global _TLS_WARNING_EMITTED
+        host = urlparse(req.full_url).netloc
+        verify = host not in self.insecure_hosts
+        try:
+            try:
+                response = self.send(req, verify)
+            except httpx.ConnectError as exc:
+                text = str(exc).lower()
+                if (
+                    not verify
+                    or not ALLOW_INSECURE_TLS_FALLBACK
+                    or "certificate verify failed" not in text
+                ):
+                    raise
+                if not _TLS_WARNING_EMITTED:
+                    emit_log(
+                        "TLS verification failed in Python runtime. Retrying with insecure TLS fallback."
+                    )
+                    _TLS_WARNING_EMITTED = True
+                note_retry(tlsFallback=True)
+                verify = False
+                self.insecure_hosts.add(host)
+                response = self.send(req, verify)
+        except httpx.HTTPError as exc:
+            raise URLError(exc) from exc
+
+        annotate_span(httpVersion=response.http_version)
+        if response.http_version == "HTTP/2":
+            record_stat("http2Requests")
+        if response.status_code >= 300:
+            # Redirects are followed, so this is a 304 or an error, as with urlopen.
+            try:
+                body = b"".join(response.iter_raw())
+            except httpx.HTTPError:
+                body = b""
+            finally:
+                response.close()
+            raise HTTPError(
+                req.full_url, response.status_code, response.reason_phrase, response.headers, io.BytesIO(body)
+            )
+        return Http2Response(self, req, verify, response)
+
+    def close(self) -> None:
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients = {}
+
+
+def configure_http2(enabled: bool, max_connections: int) -> None:
+    global _HTTP2
+    if _HTTP2 is not None:
+        _HTTP2.close()
+    _HTTP2 = None
+    if not enabled:
+        return
+    if httpx is None:
+        emit_log("HTTP/2 requested but the httpx and h2 packages are not installed. Using HTTP/1.1.")
+        return
+    _HTTP2 = Http2Transport(max_connections)
+
+
+def request_head(url: str) -> Dict[str, str]:
+    host = urlparse(url).netloc
+    with trace_span("image.head", "http", url=url, host=host):
+        req = Request(url, method="HEAD", headers={"User-Agent": USER_AGENT, "Accept": "*/*"})
+        try:
+            with open_with_tls_fallback(req) as response:
+                annotate_span(status=response.status)
+                return {k.lower(): v for k, v in response.headers.items()}
+        except HTTPError as exc:
+            annotate_span(status=exc.code)
+            raise RuntimeError(f"HTTP {exc.code} for {url}.") from exc
+        except URLError as exc:
+            raise RuntimeError(f"Network error for {url}: {exc}") from exc
+
+
+def request_probe(url: str, length: int) -> Tuple[int, Dict[str, str], bytes]:
+    # HEAD when length is 0, otherwise a GET for the first `length` bytes.
+    # HTTP errors are returned as a status rather than raised.
+    host = urlparse(url).netloc
+    with trace_span("image.probe", "http", url=url, host=host):
+        headers = {"User-Agent": USER_AGENT, "Accept": "*/*"}
+        if length:
+            headers["Range"] = f"bytes=0-{length - 1}"
+        req = Request(url, method="GET" if length else "HEAD", headers=headers)
+        record_stat("imageProbeRequests")
+        try:
+            with open_with_tls_fallback(req) as response:
+                body = b""
+                while len(body) < length:
+                    chunk = response.read(length - len(body))
+                    if not chunk:
+                        break
+                    body += chunk
+                annotate_span(status=response.status, bytes=len(body))
+                return response.status, {k.lower(): v for k, v in response.headers.items()}, body
+        except HTTPError as exc:
+            annotate_span(status=exc.code)
+            return exc.code, {k.lower(): v for k, v in (exc.headers or {}).items()}, b""
+        except URLError as exc:
+            raise RuntimeError(f"Network error for {url}: {exc}") from exc
+
+
+def request_to_file(url: str, file_path: Path) -> Dict[str, str]:
+    host = urlparse(url).netloc
+    with trace_span("image", "http", url=url, host=host):
+        req = Request(
+            url,
+            headers={
+                "User-Agent": USER_AGENT,
+                "Accept": "*/*",
+            },
+        )
+        budget = _BANDWIDTH_BUDGET
+        received = 0
+        try:
+            with open_with_tls_fallback(req) as response, file_path.open("wb") as handle:
+                headers = {k.lower(): v for k, v in response.headers.items()}
+                while True:
+                    chunk = response.read(DOWNLOAD_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    if hedge_cancelled():
+                        # The other copy of a hedged download finished first.
+                        raise RuntimeError(f"Download of {url} cancelled; its hedge finished first")
+                    handle.write(chunk)
+                    received += len(chunk)
+                    record_stat("downloadBytes", len(chunk))
+                    if budget is not None:
+                        budget.consume(host, len(chunk))
+                annotate_span(status=response.status, bytes=received)
+                return headers
+        except HTTPError as exc:
+            annotate_span(status=exc.code)
             detail = ""
-        raise RuntimeError(f"HTTP {exc.code} for {url}. {detail}") from exc
-    except URLError as exc:
-        raise RuntimeError(f"Network error for {url}: {exc}") from exc
+            try:
+                detail = exc.read().decode("utf-8", errors="replace")[:200]
+            except Exception:
+                detail = ""
+            raise RuntimeError(f"HTTP {exc.code} for {url}. {detail}") from exc
+        except URLError as exc:
+            raise RuntimeError(f"Network error for {url}: {exc}") from exc
+
+
+class ResponseCache:
+    """Disk cache for API JSON bodies keyed by URL, with TTL, validators and a size cap."""
+
+    def __init__(self, directory: Path, ttl_seconds: int, max_bytes: int) -> None:
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sweep_partial_writes()
+        self._total_bytes = sum(entry.stat().st_size for entry in self.directory.glob("*.json"))
+
+    def _sweep_partial_writes(self) -> None:
+        # Temp files left by a crashed run. Recent ones may belong to another
+        # worker sharing the directory, so only old files are removed.
+        cutoff = time.time() - CACHE_STALE_TMP_SECONDS
+        for partial in self.directory.glob("*.tmp"):
+            try:
+                if partial.stat().st_mtime < cutoff:
+                    partial.unlink()
+            except OSError:
+                continue
 
+    def path_for(self, url: str) -> Path:
+        return self.directory / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
 
-def request_json(url: str, allow_404: bool = False) -> Any:
-    req = Request(
-        url,
-        headers={
-            "User-Agent": USER_AGENT,
-            "Accept": "application/json",
-        },
-    )
-    try:
-        with open_with_tls_fallback(req) as response:
-            body = response.read().decode("utf-8", errors="replace")
-            return json.loads(body)
-    except HTTPError as exc:
-        if allow_404 and exc.code == 404:
+    def load(self, url: str) -> Optional[Dict[str, Any]]:
+        path = self.path_for(url)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get("url") != url:
             return None
-        detail = ""
+        return entry
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - float(entry.get("storedAt") or 0) < self.ttl_seconds
+
+    def touch(self, url: str, entry: Dict[str, Any]) -> None:
+        entry["storedAt"] = time.time()
+        self.store(url, entry)
+
+    def store(self, url: str, entry: Dict[str, Any]) -> None:
+        path = self.path_for(url)
+        data = json.dumps({**entry, "url": url}, ensure_ascii=False).encode("utf-8")
+        handle, temp_name = tempfile.mkstemp(dir=str(self.directory), suffix=".tmp")
+        with os.fdopen(handle, "wb") as temp:
+            temp.write(data)
+        with self._lock:
+            previous = path.stat().st_size if path.exists() else 0
+            os.replace(temp_name, path)
+            self._total_bytes += len(data) - previous
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Oldest storedAt first; touch() on revalidation keeps hot entries young.
+        entries = sorted(self.directory.glob("*.json"), key=lambda entry: entry.stat().st_mtime)
+        target = int(self.max_bytes * 0.9)
+        for entry in entries:
+            if self._total_bytes <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                entry.unlink()
+            except OSError:
+                continue
+            self._total_bytes -= size
+            record_stat("cacheEvictions")
+
+
+def configure_response_cache(directory: str, ttl_seconds: int, max_mb: int) -> None:
+    global _RESPONSE_CACHE
+    if not has_content(directory):
+        _RESPONSE_CACHE = None
+        return
+    _RESPONSE_CACHE = ResponseCache(
+        Path(directory).expanduser().resolve(), ttl_seconds, max_mb * 1024 * 1024
+    )
+
+
+def request_json(
+    url: str, allow_404: bool = False, headers_out: Optional[Dict[str, str]] = None
+) -> Any:
+    hedger = _HEDGER
+    if hedger is not None:
+        return hedger.run(
+            "api",
+            lambda _: request_document(url, json.loads, "application/json", allow_404, headers_out),
+        )
+    return request_document(url, json.loads, "application/json", allow_404, headers_out)
+
+
+def request_document(
+    url: str,
+    parse: Callable[[str], Any],
+    accept: str,
+    allow_404: bool = False,
+    headers_out: Optional[Dict[str, str]] = None,
+) -> Any:
+    # Bodies are only cached once `parse` has accepted them. Response headers
+    # are copied to `headers_out` for network responses (not for cache hits).
+    kind = "page" if "html" in accept else request_kind(url)
+    with trace_span(kind, "http", url=url, host=urlparse(url).netloc):
+        cache = _RESPONSE_CACHE
+        cached = cache.load(url) if cache is not None else None
+        if cached is not None and cache.is_fresh(cached):
+            record_stat("cacheHits")
+            annotate_span(status="cache")
+            return parse(cached["body"])
+
+        headers = {
+            "User-Agent": USER_AGENT,
+            "Accept": accept,
+        }
+        if HTTP_COMPRESSION:
+            headers["Accept-Encoding"] = ACCEPT_ENCODING
+        if cached is not None:
+            if has_content(cached.get("etag")):
+                headers["If-None-Match"] = cached["etag"]
+            if has_content(cached.get("lastModified")):
+                headers["If-Modified-Since"] = cached["lastModified"]
+        req = Request(url, headers=headers)
         try:
-            detail = exc.read().decode("utf-8", errors="replace")[:200]
-        except Exception:
+            with open_with_tls_fallback(req) as response:
+                raw = response.read()
+                decoded = decode_content(raw, response.headers.get("Content-Encoding"))
+                record_stat("apiRequests")
+                record_stat("apiBytesOnWire", len(raw))
+                record_stat("apiBytesDecoded", len(decoded))
+                annotate_span(status=response.status, bytes=len(raw), decodedBytes=len(decoded))
+                if headers_out is not None:
+                    headers_out.update({k.lower(): v for k, v in response.headers.items()})
+                body = decoded.decode("utf-8", errors="replace")
+                data = parse(body)
+                if cache is not None:
+                    record_stat("cacheMisses")
+                    cache.store(
+                        url,
+                        {
+                            "storedAt": time.time(),
+                            "etag": response.headers.get("ETag"),
+                            "lastModified": response.headers.get("Last-Modified"),
+                            "body": body,
+                        },
+                    )
+                return data
+        except HTTPError as exc:
+            annotate_span(status=exc.code)
+            if exc.code == 304 and cached is not None:
+                record_stat("apiRequests")
+                record_stat("cacheRevalidated")
+                cache.touch(url, cached)
+                return parse(cached["body"])
+            if allow_404 and exc.code == 404:
+                return None
             detail = ""
-        raise RuntimeError(f"HTTP {exc.code} for {url}. {detail}") from exc
-    except URLError as exc:
-        raise RuntimeError(f"Network error for {url}: {exc}") from exc
-    except json.JSONDecodeError as exc:
-        raise RuntimeError(f"Invalid JSON from {url}: {exc}") from exc
+            try:
+                detail = decode_content(exc.read(), exc.headers.get("Content-Encoding"))
+                detail = detail.decode("utf-8", errors="replace")[:200]
+            except Exception:
+                detail = ""
+            raise RuntimeError(f"HTTP {exc.code} for {url}. {detail}") from exc
+        except URLError as exc:
+            raise RuntimeError(f"Network error for {url}: {exc}") from exc
+        except json.JSONDecodeError as exc:
+            raise RuntimeError(f"Invalid JSON from {url}: {exc}") from exc
 
 
 def is_tls_verification_error(exc: URLError) -> bool:
@@ -143,6 +1371,9 @@ def is_tls_verification_error(exc: URLError) -> bool:
 
 def open_with_tls_fallback(req: Request):
     global _TLS_WARNING_EMITTED
+    transport = _HTTP2
+    if transport is not None:
+        return transport.open(req)
     try:
         return urlopen(req, timeout=REQUEST_TIMEOUT)
     except URLError as exc:
@@ -155,6 +1386,7 @@ def open_with_tls_fallback(req: Request):
             )
             _TLS_WARNING_EMITTED = True
 
+        note_retry(tlsFallback=True)
         context = ssl._create_unverified_context()
         return urlopen(req, timeout=REQUEST_TIMEOUT, context=context)
 
@@ -439,7 +1671,9 @@ def resolve_variation_image_src(variation: Dict[str, Any], site_root: str) -> st
     return ""
 
 
-def simplify_variation(variation: Dict[str, Any], site_root: str) -> Dict[str, Any]:
+def simplify_variation(
+    variation: Dict[str, Any], site_root: str, source: str = "api"
+) -> Dict[str, Any]:
     prices = normalize_variation_prices(variation)
     image_src = resolve_variation_image_src(variation, site_root)
     image = {"src": image_src} if image_src else None
@@ -456,8 +1690,8 @@ def simplify_variation(variation: Dict[str, Any], site_root: str) -> Dict[str, A
         "missing_price": not has_content(prices.get("regular_price"))
         and not has_content(prices.get("price")),
         "missing_image": not has_content(image_src),
-        "price_source": "api",
-        "image_source": "api",
+        "price_source": source,
+        "image_source": source,
     }
 
     return {
@@ -519,47 +1753,226 @@ def simplify_product(product: Dict[str, Any], site_root: str) -> Dict[str, Any]:
     }
 
 
-def fetch_products(site_root: str, max_products: int) -> List[Dict[str, Any]]:
+def products_endpoint(site_root: str, per_page: int, page: int, trim_fields: bool) -> str:
+    endpoint = f"{site_root}wp-json/wc/store/v1/products?per_page={per_page}&page={page}"
+    if trim_fields:
+        endpoint += f"&_fields={PRODUCT_FIELDS}"
+    return endpoint
+
+
+def fetch_products(
+    site_root: str,
+    max_products: int,
+    trim_fields: bool = False,
+    page_start: int = 1,
+    page_step: int = 1,
+    page_limit: int = 0,
+    last_page_items: int = 0,
+    pages_out: Optional[List[List[int]]] = None,
+    on_page: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    tuning_out: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    # With on_page, each page is handed over as it arrives and nothing is accumulated.
+    # With tuning_out, page size and page concurrency are auto-tuned and the
+    # chosen configuration is written to it.
     products: List[Dict[str, Any]] = []
-    page = 1
+    total = 0
+    # X-WP-Total from the first page, narrowed to the pages this worker crawls;
+    # it is sent as productsTotal so the scanning ETA has a target.
+    first_headers: Dict[str, str] = {}
+    products_total = 0
+
+    def read_products_total() -> None:
+        nonlocal products_total
+        try:
+            catalog_total = int(str(first_headers.get("x-wp-total") or "").strip())
+        except ValueError:
+            return
+        last_page = -(-catalog_total // PRODUCTS_PER_PAGE)
+        if page_limit > 0:
+            last_page = min(last_page, page_limit)
+        for page in range(page_start, last_page + 1, page_step):
+            items = min(PRODUCTS_PER_PAGE, catalog_total - (page - 1) * PRODUCTS_PER_PAGE)
+            if last_page_items > 0 and page == page_limit:
+                items = min(items, last_page_items)
+            products_total += items
+
+    def accept(page: int, data: List[Dict[str, Any]], page_size: int) -> bool:
+        # Returns True once no further pages are needed.
+        nonlocal total
+        if not total and first_headers:
+            read_products_total()
+        if last_page_items > 0 and page == page_limit:
+            data = data[:last_page_items]
+
+        limit_reached = max_products > 0 and total + len(data) >= max_products
+        if limit_reached:
+            data = data[: max_products - total]
+        total += len(data)
+        if on_page is not None:
+            on_page(data)
+        else:
+            products.extend(data)
+        if pages_out is not None:
+            pages_out.append([page, len(data)])
+        if limit_reached:
+            emit_log(f"Reached maxProducts limit ({max_products}).")
+            return True
 
-    while True:
-        endpoint = (
-            f"{site_root}wp-json/wc/store/v1/products?"
-            f"per_page={PRODUCTS_PER_PAGE}&page={page}"
+        emit_log(f"Products page {page}: +{len(data)} (total={total}).")
+        patch = {
+            "stage": "scanning_products",
+            "productsDiscovered": total,
+            "productsProcessed": 0,
+            "imagesDownloaded": 0,
+            "imagesSkipped": 0,
+            "csvGenerated": 0,
+            "variationProductsTotal": 0,
+            "variationProductsProcessed": 0,
+        }
+        if products_total:
+            patch["productsTotal"] = products_total
+        emit_progress(patch)
+        return len(data) < page_size
+
+    if tuning_out is not None:
+        autotune_product_pages(site_root, trim_fields, accept, tuning_out, first_headers)
+        return products
+
+    page = page_start
+    while page_limit <= 0 or page <= page_limit:
+        data = request_json(
+            products_endpoint(site_root, PRODUCTS_PER_PAGE, page, trim_fields),
+            headers_out=first_headers if page == page_start else None,
         )
-        data = request_json(endpoint)
         if not isinstance(data, list) or not data:
             break
-
-        products.extend(data)
-        if max_products > 0 and len(products) >= max_products:
-            products = products[:max_products]
-            emit_log(f"Reached maxProducts limit ({max_products}).")
+        if accept(page, data, PRODUCTS_PER_PAGE):
             break
+        page += page_step
 
-        emit_log(f"Products page {page}: +{len(data)} (total={len(products)}).")
-        emit_progress(
-            {
-                "stage": "scanning_products",
-                "productsDiscovered": len(products),
-                "productsProcessed": 0,
-                "imagesDownloaded": 0,
-                "imagesSkipped": 0,
-                "csvGenerated": 0,
-                "variationProductsTotal": 0,
-                "variationProductsProcessed": 0,
-            }
-        )
+    return products
 
-        if len(data) < PRODUCTS_PER_PAGE:
-            break
-        page += 1
 
-    return products
+def autotune_product_pages(
+    site_root: str,
+    trim_fields: bool,
+    accept: Callable[[int, List[Dict[str, Any]], int], bool],
+    report: Dict[str, Any],
+    first_headers: Optional[Dict[str, str]] = None,
+) -> None:
+    # Probing fetches real catalog pages, so nothing is requested twice: first
+    # one aligned range per page size, then batches of pages at rising
+    # concurrency. The best measured throughput (products/s) is kept.
+    started = time.monotonic()
+    covered = 0
+    size_rates: Dict[int, float] = {}
+    concurrency_rates: Dict[int, float] = {}
+    report.update({"pageSize": PRODUCTS_PER_PAGE, "pageConcurrency": 1})
+
+    def fetch_page(size: int, page: int) -> Any:
+        return request_json(
+            products_endpoint(site_root, size, page, trim_fields),
+            headers_out=first_headers if page == 1 and not covered else None,
+        )
 
+    def take(size: int, page: int, data: Any) -> bool:
+        nonlocal covered
+        if not isinstance(data, list) or not data:
+            return True
+        covered += len(data)
+        return accept(page, data, size)
+
+    def finish() -> None:
+        report["pageRates"] = {str(size): round(rate, 1) for size, rate in size_rates.items()}
+        report["concurrencyRates"] = {
+            str(level): round(rate, 1) for level, rate in concurrency_rates.items()
+        }
+        emit_log(
+            f"Auto-tune: per_page={report['pageSize']}, page concurrency="
+            f"{report['pageConcurrency']} (products/s by page size {report['pageRates']}, "
+            f"by concurrency {report['concurrencyRates']})."
+        )
 
-def fetch_product_variations(site_root: str, product_id: Any) -> List[Dict[str, Any]]:
+    for index, size in enumerate(AUTOTUNE_PAGE_SIZES):
+        if size_rates and time.monotonic() - started > AUTOTUNE_SECONDS:
+            break
+        next_size = AUTOTUNE_PAGE_SIZES[min(index + 1, len(AUTOTUNE_PAGE_SIZES) - 1)]
+        items, seconds = 0, 0.0
+        try:
+            while True:
+                page = covered // size + 1
+                page_started = time.monotonic()
+                data = fetch_page(size, page)
+                seconds += time.monotonic() - page_started
+                items += len(data) if isinstance(data, list) else 0
+                if take(size, page, data):
+                    size_rates[size] = items / max(seconds, 1e-6)
+                    report["pageSize"] = max(size_rates, key=lambda key: size_rates[key])
+                    finish()
+                    return
+                if covered % next_size == 0:
+                    break
+        except RuntimeError as exc:
+            if not size_rates:
+                raise
+            emit_log(f"Auto-tune: per_page={size} failed ({exc}); keeping smaller pages.")
+            break
+        size_rates[size] = items / max(seconds, 1e-6)
+
+    page_size = max(size_rates, key=lambda key: size_rates[key])
+    report["pageSize"] = page_size
+    next_page = covered // page_size + 1
+    concurrency = 1
+    concurrency_rates[1] = size_rates[page_size]
+
+    level = 2
+    while level <= PAGE_CONCURRENCY and time.monotonic() - started <= AUTOTUNE_SECONDS:
+        pages = list(range(next_page, next_page + level * 2))
+        batch_started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=level) as pool:
+                batch = list(pool.map(lambda page: fetch_page(page_size, page), pages))
+        except RuntimeError as exc:
+            emit_log(f"Auto-tune: page concurrency {level} failed ({exc}).")
+            break
+        rate = sum(len(data) for data in batch if isinstance(data, list)) / max(
+            time.monotonic() - batch_started, 1e-6
+        )
+        concurrency_rates[level] = rate
+        for page, data in zip(pages, batch):
+            if take(page_size, page, data):
+                report["pageConcurrency"] = concurrency
+                finish()
+                return
+        next_page = pages[-1] + 1
+        if rate < concurrency_rates[concurrency] * AUTOTUNE_MIN_GAIN:
+            break
+        concurrency = level
+        level *= 2
+
+    report["pageConcurrency"] = concurrency
+    finish()
+
+    # Pages are requested ahead of time and handed over in order.
+    set_pool_size("pages", concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending: deque = deque()
+        while True:
+            while len(pending) < concurrency:
+                future = submit_pooled(pool, "pages", fetch_page, page_size, next_page)
+                pending.append((next_page, future))
+                next_page += 1
+            page, future = pending.popleft()
+            if take(page_size, page, future.result()):
+                break
+        for _, future in pending:
+            future.cancel()
+
+
+def fetch_product_variations(
+    site_root: str, product_id: Any, trim_fields: bool = False
+) -> List[Dict[str, Any]]:
     if not has_content(product_id):
         return []
 
@@ -571,6 +1984,8 @@ def fetch_product_variations(site_root: str, product_id: Any) -> List[Dict[str,
             f"{site_root}wp-json/wc/store/v1/products/{product_id}/variations?"
             f"per_page={PRODUCTS_PER_PAGE}&page={page}"
         )
+        if trim_fields:
+            endpoint += f"&_fields={VARIATION_FIELDS}"
         data = request_json(endpoint, allow_404=True)
         if data is None:
             return []
@@ -585,6 +2000,153 @@ def fetch_product_variations(site_root: str, product_id: Any) -> List[Dict[str,
     return variations
 
 
+def format_html_price(value: Any, minor_unit: int) -> str:
+    if not has_content(value):
+        return ""
+    try:
+        numeric = float(str(value).replace(",", ".").strip())
+    except ValueError:
+        return ""
+    return f"{numeric:.{minor_unit}f}" if minor_unit > 0 else str(int(round(numeric)))
+
+
+def map_html_variation(
+    variation: Any, minor_unit: int, parent_options: Dict[str, Dict[str, str]]
+) -> Optional[Dict[str, Any]]:
+    # Maps one entry of WooCommerce's `data-product_variations` to the Store API
+    # variation shape. Prices there are decimal display prices, not minor units,
+    # and taxonomy attribute values are term slugs, mapped back to the parent's
+    # option names where possible.
+    if not isinstance(variation, dict):
+        return None
+
+    price = format_html_price(
+        first_non_empty([variation.get("display_price"), variation.get("price")]), minor_unit
+    )
+    regular_price = format_html_price(
+        first_non_empty([variation.get("display_regular_price"), variation.get("regular_price")]),
+        minor_unit,
+    ) or price
+    sale_price = ""
+    if price and regular_price and float(regular_price) > float(price):
+        sale_price = price
+
+    attributes = []
+    raw_attributes = variation.get("attributes")
+    if isinstance(raw_attributes, dict):
+        for key, value in raw_attributes.items():
+            if has_content(value):
+                name = re.sub(r"^attribute_", "", str(key))
+                options = parent_options.get(slugify(name), {})
+                attributes.append(
+                    {"name": name, "value": options.get(slugify(value), str(value))}
+                )
+
+    image = variation.get("image") if isinstance(variation.get("image"), dict) else {}
+    image_src = first_non_empty([image.get("full_src"), image.get("src"), image.get("url")])
+    is_in_stock = variation.get("is_in_stock")
+
+    return {
+        "id": variation.get("variation_id") or variation.get("id"),
+        "name": variation.get("name") or "",
+        "sku": variation.get("sku") or "",
+        "description": variation.get("variation_description") or "",
+        "stock_status": None if is_in_stock is None else ("instock" if is_in_stock else "outofstock"),
+        "is_in_stock": is_in_stock,
+        "prices": {
+            "price": price,
+            "regular_price": regular_price,
+            "sale_price": sale_price,
+            "currency_minor_unit": minor_unit,
+        },
+        "attributes": attributes,
+        "image": {"src": image_src} if image_src else None,
+        "raw": variation,
+    }
+
+
+def parse_product_page_variations(page: str) -> List[Any]:
+    variations: List[Any] = []
+    for form in re.finditer(r"<form\b[^>]*>", page, flags=re.IGNORECASE):
+        tag = form.group(0)
+        if "variations_form" not in tag:
+            continue
+        attribute = re.search(r"data-product_variations\s*=\s*(\"([^\"]*)\"|'([^']*)')", tag)
+        if not attribute:
+            continue
+        value = attribute.group(2) if attribute.group(2) is not None else attribute.group(3)
+        try:
+            parsed = json.loads(unescape(value))
+        except json.JSONDecodeError:
+            continue
+        # Above the store's AJAX threshold (30 variations by default) WooCommerce
+        # renders `false` here and loads variations on demand instead.
+        if isinstance(parsed, list):
+            variations.extend(parsed)
+    return variations
+
+
+def fetch_variations_from_product_page(
+    product: Dict[str, Any], site_root: str
+) -> List[Dict[str, Any]]:
+    permalink = to_absolute_url(product.get("permalink"), site_root)
+    if not permalink:
+        return []
+
+    prices = product.get("prices") if isinstance(product.get("prices"), dict) else {}
+    minor_unit = prices.get("currency_minor_unit")
+    minor_unit = int(minor_unit) if str(minor_unit).isdigit() else 2
+    parent_options = {
+        attribute["slug"]: {slugify(option): option for option in attribute.get("options") or []}
+        for attribute in product.get("attributes") or []
+        if isinstance(attribute, dict) and has_content(attribute.get("slug"))
+    }
+    try:
+        found = request_document(
+            permalink, parse_product_page_variations, "text/html", allow_404=True
+        )
+    except Exception as exc:
+        emit_log(f"Product {product.get('id')}: product page unavailable ({exc}).")
+        return []
+    record_stat("productPageRequests")
+
+    variations = []
+    for item in found or []:
+        mapped = map_html_variation(item, minor_unit, parent_options)
+        if mapped is not None:
+            variations.append(mapped)
+    return variations
+
+
+def resolve_variation_source(value: Any) -> str:
+    text = str(value or "").strip().lower()
+    if text in ("", "auto"):
+        return "auto"
+    if text in ("api", "html"):
+        return text
+    raise ValueError(f"Unsupported variation source: {value}")
+
+
+def fetch_variations_for_product(
+    product: Dict[str, Any], site_root: str, trim_fields: bool, source: str
+) -> Tuple[List[Dict[str, Any]], str]:
+    # "auto": Store API first, product page when the endpoint is disabled (404)
+    # or returns nothing for a product that lists variations.
+    # "html": product page first (one request for every variation), Store API
+    # when the page has no inline variation data.
+    if source == "html":
+        variations = fetch_variations_from_product_page(product, site_root)
+        if variations:
+            return variations, "html"
+
+    variations = fetch_product_variations(site_root, product.get("id"), trim_fields)
+    if variations or source != "auto":
+        return variations, "api"
+    if variation_cost(product) == 0 and product.get("type") != "variable":
+        return variations, "api"
+    return fetch_variations_from_product_page(product, site_root), "html"
+
+
 def is_variable_product(product: Dict[str, Any]) -> bool:
     if str(product.get("type") or "").lower() == "variable":
         return True
@@ -605,6 +2167,183 @@ def destination_for_image(url: str, image_dir: Path) -> Path:
     return image_dir / f"{stem}-{digest}{ext}"
 
 
+def collect_product_image_urls(product: Dict[str, Any]) -> List[str]:
+    image_urls: List[str] = []
+    seen = set()
+    for image in product.get("images") or []:
+        if isinstance(image, dict) and has_content(image.get("src")):
+            src = str(image["src"])
+            if src not in seen:
+                seen.add(src)
+                image_urls.append(src)
+
+    for variation in product.get("variationDetails") or []:
+        if not isinstance(variation, dict):
+            continue
+        image = variation.get("image")
+        if isinstance(image, dict) and has_content(image.get("src")):
+            src = str(image["src"])
+            if src not in seen:
+                seen.add(src)
+                image_urls.append(src)
+    return image_urls
+
+
+def resolve_schedule(value: Any) -> str:
+    text = str(value or "").strip().lower()
+    if text in ("", "ljf", "largest"):
+        return "ljf"
+    if text in ("fifo", "0", "off"):
+        return "fifo"
+    raise ValueError(f"Unsupported schedule: {value}")
+
+
+def variation_cost(product: Dict[str, Any]) -> int:
+    # The listing already carries the variation ids, so their count is a good
+    # estimate of how many requests and rows the product will need.
+    raw = product.get("raw") if isinstance(product.get("raw"), dict) else {}
+    variations = raw.get("variations")
+    return len(variations) if isinstance(variations, list) else 0
+
+
+def schedule_jobs(jobs: List[Any], cost: Callable[[Any], int], schedule: str) -> List[Any]:
+    # Longest job first: the expensive products start while the pool is still
+    # full instead of running alone at the end. The sort is stable, so equal
+    # costs keep catalog order.
+    if schedule != "ljf":
+        return jobs
+    return sorted(jobs, key=cost, reverse=True)
+
+
+def schedule_windowed(jobs: Iterable[Any], cost: Callable[[Any], int], window: int) -> Iterator[Any]:
+    # Longest job first within each run of `window` jobs, for job streams that
+    # must not be read into memory at once.
+    batch: List[Any] = []
+    for job in jobs:
+        batch.append(job)
+        if len(batch) >= window:
+            yield from sorted(batch, key=cost, reverse=True)
+            batch = []
+    yield from sorted(batch, key=cost, reverse=True)
+
+
+def timed_call(fn: Callable[..., Any], *args: Any) -> Tuple[float, float, Any]:
+    started = time.monotonic()
+    result = fn(*args)
+    return started, time.monotonic(), result
+
+
+class StageTimer:
+    """Collects per-job spans of a pooled stage so the tail can be reported."""
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.jobs = 0
+        self.slowest = 0.0
+        self.last_start = self.started
+
+    def record(self, job_started: float, job_finished: float) -> None:
+        self.jobs += 1
+        self.slowest = max(self.slowest, job_finished - job_started)
+        self.last_start = max(self.last_start, job_started)
+
+    def summary(self) -> Dict[str, Any]:
+        finished = time.monotonic()
+        # Time between the last job starting and the stage ending: the pool is
+        # draining and workers sit idle.
+        return {
+            "seconds": round(finished - self.started, 3),
+            "jobs": self.jobs,
+            "slowestJobMs": int(self.slowest * 1000),
+            "tailMs": int((finished - self.last_start) * 1000) if self.jobs else 0,
+        }
+
+
+def iter_image_jobs(
+    products: Iterable[Dict[str, Any]],
+    products_dir: Path,
+    image_slots: Dict[str, List[Optional[Dict[str, str]]]],
+    create_dirs: bool = True,
+    collapse_sizes: bool = False,
+) -> Iterator[Tuple[Tuple[str, int, str], Optional[Tuple[List[str], Path]]]]:
+    # Each job carries its candidate URLs: just the image itself, or with
+    # collapse_sizes every listed size of one upload, largest first. Products
+    # without images yield a single job with no arguments so the caller can still
+    # count them as processed.
+    for product in products:
+        product_slug = sanitize_segment(product.get("slug") or product.get("id"))
+        product_id = sanitize_segment(product.get("id") or "item")
+        image_dir = products_dir / f"{product_slug}-{product_id}" / "images"
+        if create_dirs:
+            image_dir.mkdir(parents=True, exist_ok=True)
+
+        key = str(product.get("id"))
+        image_urls = collect_product_image_urls(product)
+        if collapse_sizes:
+            groups = group_image_variants(image_urls)
+            record_stat("imageVariantsCollapsed", len(image_urls) - len(groups))
+        else:
+            groups = [[image_url] for image_url in image_urls]
+        image_slots[key] = [None] * len(groups)
+        if not groups:
+            yield (key, -1, ""), None
+        for position, candidates in enumerate(groups):
+            yield (key, position, candidates[0]), (candidates, image_dir)
+
+
+def iter_windowed_results(
+    pool: ThreadPoolExecutor,
+    fn: Callable[..., Any],
+    jobs: Iterable[Tuple[Any, Optional[Tuple[Any, ...]]]],
+    window: int,
+    name: str = "",
+) -> Iterator[Tuple[Any, Optional["Future[Any]"]]]:
+    # Submits jobs lazily, keeping at most `window` in flight, and yields them as
+    # they complete. Jobs without arguments are passed through with no future.
+    in_flight: Dict["Future[Any]", Any] = {}
+    for meta, args in jobs:
+        if args is None:
+            yield meta, None
+            continue
+        in_flight[submit_pooled(pool, name, fn, *args)] = meta
+        while len(in_flight) >= window:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield in_flight.pop(future), future
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield in_flight.pop(future), future
+
+
+def fetch_image(url: str, destination: Path) -> Path:
+    def attempt(index: int) -> Tuple[Dict[str, str], Path]:
+        partial = destination.with_name(destination.name + (".part" if index == 0 else ".hedge.part"))
+        try:
+            return request_to_file(url, partial), partial
+        except Exception:
+            partial.unlink(missing_ok=True)
+            raise
+
+    hedger = _HEDGER
+    if hedger is None:
+        headers, partial = attempt(0)
+    else:
+        headers, partial = hedger.run(
+            "image", attempt, lambda result: result[1].unlink(missing_ok=True)
+        )
+
+    target = destination
+    if destination.suffix == ".bin":
+        content_type = str(headers.get("content-type") or "").split(";")[0].strip().lower()
+        guessed_ext = mimetypes.guess_extension(content_type) if content_type else None
+        if guessed_ext:
+            target = destination.with_suffix(guessed_ext)
+
+    os.replace(partial, target)
+    return target
+
+
 def download_image(url: str, image_dir: Path) -> Dict[str, Any]:
     if not has_content(url):
         return {"skipped": True}
@@ -613,17 +2352,173 @@ def download_image(url: str, image_dir: Path) -> Dict[str, Any]:
     destination = destination_for_image(url, image_dir)
     if destination.exists():
         return {"skipped": True, "path": str(destination)}
+    return {"skipped": False, "path": str(fetch_image(url, destination))}
 
-    body, headers = request_bytes(url)
-    target = destination
-    if destination.suffix == ".bin":
-        content_type = str(headers.get("content-type") or "").split(";")[0].strip().lower()
-        guessed_ext = mimetypes.guess_extension(content_type) if content_type else None
-        if guessed_ext:
-            target = destination.with_suffix(guessed_ext)
 
-    target.write_bytes(body)
-    return {"skipped": False, "path": str(target)}
+def stage_image(url: str, image_dir: Path, staging_dir: Path) -> Dict[str, Any]:
+    # Bundle mode: the image is fetched into one flat staging folder and the
+    # caller moves it into the archive under the path it would have had on disk.
+    if not has_content(url):
+        return {"skipped": True}
+
+    member = destination_for_image(url, image_dir)
+    staged_name = hashlib.sha1(str(member).encode("utf-8")).hexdigest() + member.suffix
+    staged = fetch_image(url, staging_dir / staged_name)
+    return {"skipped": False, "path": str(member.with_suffix(staged.suffix)), "staged": str(staged)}
+
+
+def resolve_image_types(value: Any) -> Tuple[str, ...]:
+    types = []
+    for item in str(value or "").replace(";", ",").split(","):
+        text = item.strip().lower()
+        if text.startswith("image/"):
+            text = text[len("image/") :]
+        if text == "jpg":
+            text = "jpeg"
+        if text and text not in types:
+            types.append(text)
+    return tuple(types)
+
+
+def image_variant_key(url: str) -> Tuple[str, Optional[Tuple[int, int]]]:
+    # Returns the URL of the original upload and, for intermediate sizes, the
+    # dimensions encoded in the file name.
+    parsed = urlparse(url)
+    match = WP_IMAGE_SIZE_SUFFIX.search(parsed.path)
+    if not match:
+        return url, None
+    original = parsed._replace(path=parsed.path[: match.start()] + parsed.path[match.end() :]).geturl()
+    if match.group(1):
+        return original, (int(match.group(1)), int(match.group(2)))
+    return original, None
+
+
+def group_image_variants(image_urls: List[str]) -> List[List[str]]:
+    # One group per original upload, in catalog order. Candidates are tried
+    # largest first: the original (listed or not), the -scaled copy, then the
+    # listed intermediate sizes by area.
+    groups: Dict[str, List[Tuple[str, Optional[Tuple[int, int]]]]] = {}
+    for url in image_urls:
+        original, dimensions = image_variant_key(url)
+        groups.setdefault(original, []).append((url, dimensions))
+    candidates = []
+    for original, variants in groups.items():
+        ordered = sorted(
+            (entry for entry in variants if entry[0] != original),
+            key=lambda entry: (0, 0) if entry[1] is None else (1, -entry[1][0] * entry[1][1]),
+        )
+        candidates.append([original] + [url for url, _ in ordered])
+    return candidates
+
+
+def image_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    # Width and height from the first bytes of a PNG, GIF, WebP or JPEG file.
+    if data.startswith(b"\x89PNG\r\n\x1a\n") and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        return struct.unpack("<HH", data[6:10])
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+        return None
+    if data[:2] == b"\xff\xd8":
+        index = 2
+        while index + 9 <= len(data):
+            if data[index] != 0xFF:
+                return None
+            marker = data[index + 1]
+            if marker == 0xFF:
+                index += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                index += 2
+                continue
+            if marker in JPEG_SOF_MARKERS:
+                height, width = struct.unpack(">HH", data[index + 5 : index + 9])
+                return width, height
+            index += 2 + struct.unpack(">H", data[index + 2 : index + 4])[0]
+    return None
+
+
+def probe_image(url: str, need_dimensions: bool) -> Dict[str, Any]:
+    status, headers, head = request_probe(url, IMAGE_PROBE_BYTES if need_dimensions else 0)
+    if status in (405, 501) and not need_dimensions:
+        # Some servers refuse HEAD; a one-byte range answers the same questions.
+        status, headers, head = request_probe(url, 1)
+    size = None
+    content_range = str(headers.get("content-range") or "")
+    if status == 206 and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1].strip()
+        size = int(total) if total.isdigit() else None
+    elif str(headers.get("content-length") or "").isdigit():
+        size = int(headers["content-length"])
+    content_type = str(headers.get("content-type") or "").split(";")[0].strip().lower()
+    if not content_type:
+        content_type = mimetypes.guess_type(urlparse(url).path)[0] or ""
+    return {
+        "status": status,
+        "bytes": size,
+        "type": content_type,
+        "dimensions": image_dimensions(head) if head else None,
+    }
+
+
+def image_limit_reason(
+    info: Dict[str, Any], dimensions: Optional[Tuple[int, int]], limits: Dict[str, Any]
+) -> str:
+    if limits["types"]:
+        main_type, _, subtype = info["type"].partition("/")
+        if main_type != "image" or subtype not in limits["types"]:
+            return f"type {info['type'] or 'unknown'}"
+    if limits["maxBytes"] and info["bytes"] is not None and info["bytes"] > limits["maxBytes"]:
+        return f"{info['bytes']} bytes"
+    if limits["maxDimension"] and dimensions is not None and max(dimensions) > limits["maxDimension"]:
+        return f"{dimensions[0]}x{dimensions[1]} px"
+    return ""
+
+
+def preflight_image(
+    candidates: List[str], limits: Dict[str, Any], download: Callable[..., Dict[str, Any]], *args: Any
+) -> Dict[str, Any]:
+    # Downloads the first candidate that exists and passes the limits. Only the
+    # last candidate is downloaded unprobed when its probe fails or is refused
+    # (some CDNs answer HEAD and ranges with 4xx); earlier ones may be originals
+    # that were never listed by the store. Dimensions in a file name are only
+    # trusted once the original is known to exist: without it, a name such as
+    # logo-1920x1080.png is probably the upload itself and is measured instead.
+    reason = ""
+    original_exists = False
+    for index, url in enumerate(candidates):
+        last = index == len(candidates) - 1
+        named = image_variant_key(url)[1] if original_exists else None
+        if named is not None and limits["maxDimension"] and max(named) > limits["maxDimension"]:
+            reason = reason or f"{named[0]}x{named[1]} px"
+            continue
+        try:
+            info = probe_image(url, bool(limits["maxDimension"]) and named is None)
+        except Exception:
+            if not last:
+                continue
+        else:
+            refused = info["status"] >= 400
+            if refused and not last:
+                continue
+            original_exists = original_exists or (index == 0 and not refused)
+            rejected = "" if refused else image_limit_reason(info, info["dimensions"] or named, limits)
+            if rejected:
+                reason = reason or rejected
+                continue
+        result = download(url, *args)
+        result["src"] = url
+        return result
+    return {"skipped": True, "filtered": reason or "not found"}
 
 
 def to_stock_flag(stock_status: Any, is_in_stock: Any) -> str:
@@ -718,7 +2613,7 @@ def build_variation_name(variation: Dict[str, Any], parent_name: str) -> str:
     return f"{parent_name or 'Variation'} - {variation.get('id') or 'item'}"
 
 
-def build_woo_import_rows(products: List[Dict[str, Any]]) -> Tuple[List[str], List[Dict[str, Any]]]:
+def count_max_attributes(products: Iterable[Dict[str, Any]]) -> int:
     max_attributes = 0
     for product in products:
         attrs_count = len(product.get("attributes") or [])
@@ -726,7 +2621,10 @@ def build_woo_import_rows(products: List[Dict[str, Any]]) -> Tuple[List[str], Li
         for variation in product.get("variationDetails") or []:
             variation_max = max(variation_max, len(variation.get("attributes") or []))
         max_attributes = max(max_attributes, attrs_count, variation_max)
+    return max_attributes
+
 
+def woo_import_headers(max_attributes: int) -> List[str]:
     headers = [
         "ID",
         "Type",
@@ -757,175 +2655,1214 @@ def build_woo_import_rows(products: List[Dict[str, Any]]) -> Tuple[List[str], Li
                 f"Attribute {position} global",
             ]
         )
+    return headers
 
+
+def build_product_import_rows(product: Dict[str, Any], max_attributes: int) -> List[Dict[str, Any]]:
     rows: List[Dict[str, Any]] = []
+    prices = product.get("prices") if isinstance(product.get("prices"), dict) else {}
+    minor_unit = prices.get("currency_minor_unit", 2)
+    is_variable = is_variable_product(product) or len(product.get("variationDetails") or []) > 0
+    product_type = "variable" if is_variable else str(product.get("type") or "simple")
+    parent_sku = str(product.get("sku") or f"parent-{product.get('id')}")
+    schema = build_product_attribute_schema(product)
+
+    categories = ", ".join(
+        [str(item.get("name")) for item in (product.get("categories") or []) if has_content(item.get("name"))]
+    )
+    tags = ", ".join(
+        [str(item.get("name")) for item in (product.get("tags") or []) if has_content(item.get("name"))]
+    )
+    images = ", ".join(
+        [
+            str(item.get("src"))
+            for item in (product.get("images") or [])
+            if isinstance(item, dict) and has_content(item.get("src"))
+        ]
+    )
 
-    for product in products:
-        prices = product.get("prices") if isinstance(product.get("prices"), dict) else {}
-        minor_unit = prices.get("currency_minor_unit", 2)
-        is_variable = is_variable_product(product) or len(product.get("variationDetails") or []) > 0
-        product_type = "variable" if is_variable else str(product.get("type") or "simple")
-        parent_sku = str(product.get("sku") or f"parent-{product.get('id')}")
-        schema = build_product_attribute_schema(product)
-
-        categories = ", ".join(
-            [str(item.get("name")) for item in (product.get("categories") or []) if has_content(item.get("name"))]
+    parent_row: Dict[str, Any] = {
+        "ID": "",
+        "Type": product_type,
+        "Parent": "",
+        "SKU": parent_sku if is_variable else str(product.get("sku") or ""),
+        "Name": str(product.get("name") or ""),
+        "Published": "1",
+        "Is featured?": "1" if product.get("is_featured") else "0",
+        "Visibility in catalog": str(product.get("catalog_visibility") or "visible"),
+        "Short description": str(product.get("short_description") or ""),
+        "Description": str(product.get("description") or ""),
+        "Tax status": str(product.get("tax_status") or "taxable"),
+        "In stock?": to_stock_flag(product.get("stock_status"), product.get("is_in_stock")),
+        "Regular price": ""
+        if is_variable
+        else minor_to_decimal(prices.get("regular_price"), minor_unit),
+        "Sale price": ""
+        if is_variable
+        else minor_to_decimal(prices.get("sale_price"), minor_unit),
+        "Categories": categories,
+        "Tags": tags,
+        "Images": images,
+    }
+
+    for index in range(max_attributes):
+        if index >= len(schema):
+            parent_row[f"Attribute {index + 1} name"] = ""
+            parent_row[f"Attribute {index + 1} value(s)"] = ""
+            parent_row[f"Attribute {index + 1} visible"] = ""
+            parent_row[f"Attribute {index + 1} global"] = ""
+            continue
+
+        entry = schema[index]
+        parent_row[f"Attribute {index + 1} name"] = entry["name"]
+        parent_row[f"Attribute {index + 1} value(s)"] = " | ".join(entry["values"])
+        parent_row[f"Attribute {index + 1} visible"] = entry["visible"]
+        parent_row[f"Attribute {index + 1} global"] = entry["global"]
+
+    rows.append(parent_row)
+
+    if not is_variable:
+        return rows
+
+    for variation in product.get("variationDetails") or []:
+        if not isinstance(variation, dict):
+            continue
+
+        variation_prices = (
+            variation.get("prices") if isinstance(variation.get("prices"), dict) else {}
         )
-        tags = ", ".join(
-            [str(item.get("name")) for item in (product.get("tags") or []) if has_content(item.get("name"))]
+        variation_minor = variation_prices.get("currency_minor_unit", minor_unit)
+        variation_regular = minor_to_decimal(
+            first_non_empty(
+                [variation_prices.get("regular_price"), variation_prices.get("price")]
+            ),
+            variation_minor,
         )
-        images = ", ".join(
-            [
-                str(item.get("src"))
-                for item in (product.get("images") or [])
-                if isinstance(item, dict) and has_content(item.get("src"))
-            ]
+        variation_sale = minor_to_decimal(variation_prices.get("sale_price"), variation_minor)
+        variation_sku = str(
+            variation.get("sku")
+            or f"{parent_sku}-var-{variation.get('id') or hashlib.sha1(parent_sku.encode('utf-8')).hexdigest()[:6]}"
         )
+        variation_image = ""
+        image = variation.get("image")
+        if isinstance(image, dict) and has_content(image.get("src")):
+            variation_image = str(image.get("src"))
 
-        parent_row: Dict[str, Any] = {
+        variation_row: Dict[str, Any] = {
             "ID": "",
-            "Type": product_type,
-            "Parent": "",
-            "SKU": parent_sku if is_variable else str(product.get("sku") or ""),
-            "Name": str(product.get("name") or ""),
+            "Type": "variation",
+            "Parent": parent_sku,
+            "SKU": variation_sku,
+            "Name": build_variation_name(variation, str(product.get("name") or "")),
             "Published": "1",
-            "Is featured?": "1" if product.get("is_featured") else "0",
-            "Visibility in catalog": str(product.get("catalog_visibility") or "visible"),
-            "Short description": str(product.get("short_description") or ""),
-            "Description": str(product.get("description") or ""),
-            "Tax status": str(product.get("tax_status") or "taxable"),
-            "In stock?": to_stock_flag(product.get("stock_status"), product.get("is_in_stock")),
-            "Regular price": ""
-            if is_variable
-            else minor_to_decimal(prices.get("regular_price"), minor_unit),
-            "Sale price": ""
-            if is_variable
-            else minor_to_decimal(prices.get("sale_price"), minor_unit),
-            "Categories": categories,
-            "Tags": tags,
-            "Images": images,
+            "Is featured?": "",
+            "Visibility in catalog": "visible",
+            "Short description": "",
+            "Description": str(variation.get("description") or ""),
+            "Tax status": str(variation.get("tax_status") or product.get("tax_status") or "taxable"),
+            "In stock?": to_stock_flag(variation.get("stock_status"), variation.get("is_in_stock")),
+            "Regular price": variation_regular,
+            "Sale price": variation_sale,
+            "Categories": "",
+            "Tags": "",
+            "Images": variation_image,
         }
 
+        selection_map = build_variation_selection_map(variation)
         for index in range(max_attributes):
             if index >= len(schema):
-                parent_row[f"Attribute {index + 1} name"] = ""
-                parent_row[f"Attribute {index + 1} value(s)"] = ""
-                parent_row[f"Attribute {index + 1} visible"] = ""
-                parent_row[f"Attribute {index + 1} global"] = ""
+                variation_row[f"Attribute {index + 1} name"] = ""
+                variation_row[f"Attribute {index + 1} value(s)"] = ""
+                variation_row[f"Attribute {index + 1} visible"] = ""
+                variation_row[f"Attribute {index + 1} global"] = ""
                 continue
 
             entry = schema[index]
-            parent_row[f"Attribute {index + 1} name"] = entry["name"]
-            parent_row[f"Attribute {index + 1} value(s)"] = " | ".join(entry["values"])
-            parent_row[f"Attribute {index + 1} visible"] = entry["visible"]
-            parent_row[f"Attribute {index + 1} global"] = entry["global"]
+            selected = ""
+            for key in entry["keys"]:
+                if key in selection_map:
+                    selected = selection_map[key]
+                    break
 
-        rows.append(parent_row)
+            variation_row[f"Attribute {index + 1} name"] = entry["name"]
+            variation_row[f"Attribute {index + 1} value(s)"] = selected
+            variation_row[f"Attribute {index + 1} visible"] = entry["visible"]
+            variation_row[f"Attribute {index + 1} global"] = entry["global"]
 
-        if not is_variable:
-            continue
+        rows.append(variation_row)
 
-        for variation in product.get("variationDetails") or []:
-            if not isinstance(variation, dict):
-                continue
+    return rows
 
-            variation_prices = (
-                variation.get("prices") if isinstance(variation.get("prices"), dict) else {}
-            )
-            variation_minor = variation_prices.get("currency_minor_unit", minor_unit)
-            variation_regular = minor_to_decimal(
-                first_non_empty(
-                    [variation_prices.get("regular_price"), variation_prices.get("price")]
-                ),
-                variation_minor,
-            )
-            variation_sale = minor_to_decimal(variation_prices.get("sale_price"), variation_minor)
-            variation_sku = str(
-                variation.get("sku")
-                or f"{parent_sku}-var-{variation.get('id') or hashlib.sha1(parent_sku.encode('utf-8')).hexdigest()[:6]}"
-            )
-            variation_image = ""
-            image = variation.get("image")
-            if isinstance(image, dict) and has_content(image.get("src")):
-                variation_image = str(image.get("src"))
-
-            variation_row: Dict[str, Any] = {
-                "ID": "",
-                "Type": "variation",
-                "Parent": parent_sku,
-                "SKU": variation_sku,
-                "Name": build_variation_name(variation, str(product.get("name") or "")),
-                "Published": "1",
-                "Is featured?": "",
-                "Visibility in catalog": "visible",
-                "Short description": "",
-                "Description": str(variation.get("description") or ""),
-                "Tax status": str(variation.get("tax_status") or product.get("tax_status") or "taxable"),
-                "In stock?": to_stock_flag(variation.get("stock_status"), variation.get("is_in_stock")),
-                "Regular price": variation_regular,
-                "Sale price": variation_sale,
-                "Categories": "",
-                "Tags": "",
-                "Images": variation_image,
-            }
 
-            selection_map = build_variation_selection_map(variation)
-            for index in range(max_attributes):
-                if index >= len(schema):
-                    variation_row[f"Attribute {index + 1} name"] = ""
-                    variation_row[f"Attribute {index + 1} value(s)"] = ""
-                    variation_row[f"Attribute {index + 1} visible"] = ""
-                    variation_row[f"Attribute {index + 1} global"] = ""
-                    continue
-
-                entry = schema[index]
-                selected = ""
-                for key in entry["keys"]:
-                    if key in selection_map:
-                        selected = selection_map[key]
-                        break
+def build_woo_import_rows(products: List[Dict[str, Any]]) -> Tuple[List[str], List[Dict[str, Any]]]:
+    max_attributes = count_max_attributes(products)
+    headers = woo_import_headers(max_attributes)
+    rows: List[Dict[str, Any]] = []
+    for product in products:
+        rows.extend(build_product_import_rows(product, max_attributes))
+    return headers, rows
 
-                variation_row[f"Attribute {index + 1} name"] = entry["name"]
-                variation_row[f"Attribute {index + 1} value(s)"] = selected
-                variation_row[f"Attribute {index + 1} visible"] = entry["visible"]
-                variation_row[f"Attribute {index + 1} global"] = entry["global"]
 
-            rows.append(variation_row)
+def resolve_compression(value: Any) -> str:
+    text = str(value or "").strip().lower()
+    if text in ("", "0", "none", "off"):
+        return ""
+    if text in ("gzip", "gz", "1"):
+        return "gzip"
+    if text in ("zstd", "zst"):
+        if zstandard is not None:
+            return "zstd"
+        emit_log("zstd compression requested but the zstandard module is not installed. Using gzip.")
+        return "gzip"
+    raise ValueError(f"Unsupported output compression: {value}")
+
+
+def compressed_path(file_path: Path, compression: str) -> Path:
+    suffix = COMPRESSION_SUFFIXES.get(compression)
+    return file_path.with_name(file_path.name + suffix) if suffix else file_path
+
+
+@contextmanager
+def open_text_input(file_path: Path, encoding: str = "utf-8"):
+    if file_path.suffix == ".gz":
+        with gzip.open(file_path, "rt", encoding=encoding) as handle:
+            yield handle
+    elif file_path.suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError(f"Reading {file_path.name} requires the zstandard module.")
+        with file_path.open("rb") as raw:
+            reader = zstandard.ZstdDecompressor().stream_reader(raw)
+            with io.TextIOWrapper(reader, encoding=encoding) as handle:
+                yield handle
+    else:
+        with file_path.open("r", encoding=encoding) as handle:
+            yield handle
+
+
+@contextmanager
+def open_text_output(file_path: Path, compression: str, encoding: str = "utf-8", newline: Optional[str] = None):
+    if compression == "gzip":
+        with gzip.open(
+            file_path, "wt", compresslevel=GZIP_LEVEL, encoding=encoding, newline=newline
+        ) as handle:
+            yield handle
+    elif compression == "zstd":
+        raw = file_path.open("wb")
+        writer = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw)
+        handle = io.TextIOWrapper(writer, encoding=encoding, newline=newline)
+        try:
+            yield handle
+        finally:
+            handle.close()
+    else:
+        with file_path.open("w", encoding=encoding, newline=newline) as handle:
+            yield handle
+
+
+def write_metadata_json(file_path: Path, payload: Dict[str, Any], compression: str = "") -> None:
+    # Same layout as json.dumps(payload, indent=2), but "products" may be any iterable
+    # (e.g. a spill store cursor) and is encoded one product at a time.
+    with open_text_output(file_path, compression) as handle:
+        handle.write("{")
+        for position, (key, value) in enumerate(payload.items()):
+            handle.write(("," if position else "") + "\n  " + json.dumps(key) + ": ")
+            if key != "products":
+                handle.write(json.dumps(value, indent=2, ensure_ascii=False).replace("\n", "\n  "))
+                continue
+            handle.write("[")
+            count = 0
+            for product in value:
+                encoded = json.dumps(product, indent=2, ensure_ascii=False).replace("\n", "\n    ")
+                handle.write(("," if count else "") + "\n    " + encoded)
+                count += 1
+            handle.write("\n  ]" if count else "]")
+        handle.write("\n}" if payload else "}")
+
+
+def iter_json_members(handle: IO[str], stream_key: str = "") -> Iterator[Tuple[str, Any]]:
+    # Reads a top-level JSON object one member at a time, so files from the
+    # streaming writers can be read back without loading them whole. The items
+    # of the `stream_key` array are yielded one by one as (stream_key, item).
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill() -> None:
+        nonlocal buffer, position, eof
+        chunk = handle.read(JSON_READ_CHUNK)
+        buffer = buffer[position:] + chunk
+        position = 0
+        eof = not chunk
+
+    def token() -> str:
+        # Consumes and returns the next character that is not whitespace.
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position < len(buffer):
+                position += 1
+                return buffer[position - 1]
+            if eof:
+                raise ValueError("Unexpected end of JSON input.")
+            fill()
+
+    def expect(*characters: str) -> str:
+        character = token()
+        if character not in characters:
+            raise ValueError(f"Expected one of {characters} in JSON input, found {character!r}.")
+        return character
+
+    def peek() -> str:
+        nonlocal position
+        character = token()
+        position -= 1
+        return character
+
+    def value() -> Any:
+        nonlocal position
+        peek()
+        while True:
+            try:
+                result, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if not eof and not buffer[end:].lstrip("0123456789.eE+-"):
+                # A number at the end of the buffer may continue in the next chunk.
+                fill()
+                continue
+            position = end
+            return result
 
-    return headers, rows
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        key = value()
+        expect(":")
+        if key == stream_key and peek() == "[":
+            token()
+            if peek() == "]":
+                token()
+            else:
+                while True:
+                    yield key, value()
+                    if expect(",", "]") == "]":
+                        break
+        else:
+            yield key, value()
+        if expect(",", "}") == "}":
+            return
 
 
-def write_csv(file_path: Path, headers: List[str], rows: List[Dict[str, Any]]) -> None:
-    with file_path.open("w", encoding="utf-8-sig", newline="") as handle:
+def write_csv(
+    file_path: Path, headers: List[str], rows: Iterable[Dict[str, Any]], compression: str = ""
+) -> None:
+    with open_text_output(file_path, compression, encoding="utf-8-sig", newline="") as handle:
         writer = csv.DictWriter(handle, fieldnames=headers, extrasaction="ignore")
         writer.writeheader()
         for row in rows:
             writer.writerow({header: row.get(header, "") for header in headers})
 
 
-def run_job(payload: Dict[str, Any]) -> Dict[str, Any]:
-    url = payload.get("url")
-    if not has_content(url):
-        raise ValueError("Missing store URL.")
+def iter_csv_shards(
+    groups: Iterable[List[Dict[str, Any]]], shard_rows: int
+) -> Iterator[List[Dict[str, Any]]]:
+    # A variable parent and its variations always land in the same shard; a group
+    # larger than shard_rows gets a shard of its own instead of being split.
+    current: List[Dict[str, Any]] = []
+    for group in groups:
+        if current and len(current) + len(group) > shard_rows:
+            yield current
+            current = []
+        current.extend(group)
+    if current:
+        yield current
+
+
+def write_csv_shard(
+    file_path: Path, headers: List[str], rows: List[Dict[str, Any]], compression: str = ""
+) -> Dict[str, Any]:
+    write_csv(file_path, headers, rows, compression)
+    digest = hashlib.sha256()
+    with file_path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return {
+        "file": file_path.name,
+        "rows": len(rows),
+        "products": sum(1 for row in rows if row.get("Type") != "variation"),
+        "bytes": file_path.stat().st_size,
+        "sha256": digest.hexdigest(),
+    }
+
 
-    max_products = 0
+def write_csv_shards(
+    woo_dir: Path,
+    headers: List[str],
+    groups: Iterable[List[Dict[str, Any]]],
+    shard_rows: int,
+    compression: str = "",
+    base_name: str = "woocommerce-import",
+) -> Tuple[Path, List[Dict[str, Any]]]:
+    futures = []
+    with ThreadPoolExecutor(max_workers=CSV_SHARD_CONCURRENCY) as pool:
+        for index, shard in enumerate(iter_csv_shards(groups, shard_rows), start=1):
+            path = compressed_path(woo_dir / f"{base_name}-{str(index).zfill(3)}.csv", compression)
+            futures.append(pool.submit(write_csv_shard, path, headers, shard, compression))
+            # Keep at most two rounds of shards in memory while the pool writes them.
+            in_flight = [future for future in futures if not future.done()]
+            if len(in_flight) >= CSV_SHARD_CONCURRENCY * 2:
+                in_flight[0].result()
+        entries = [future.result() for future in futures]
+    total_rows = sum(entry["rows"] for entry in entries)
+
+    manifest_path = woo_dir / f"{base_name}-manifest.json"
+    manifest_path.write_text(
+        json.dumps(
+            {
+                "shardRows": shard_rows,
+                "totalRows": total_rows,
+                "totalShards": len(entries),
+                "shards": entries,
+            },
+            indent=2,
+            ensure_ascii=False,
+        ),
+        encoding="utf-8",
+    )
+    return manifest_path, entries
+
+
+def product_fingerprint(product: Dict[str, Any]) -> str:
+    canonical = json.dumps(product, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def fingerprint_entry(product: Dict[str, Any], fingerprint: str) -> Dict[str, Any]:
+    return {
+        "fingerprint": fingerprint,
+        "slug": product.get("slug"),
+        "sku": product.get("sku"),
+        "name": product.get("name"),
+    }
+
+
+def find_export_file(export_dir: Path, name: str) -> Optional[Path]:
+    for folder in (export_dir / "woocommerce", export_dir):
+        for suffix in ("", ".gz", ".zst"):
+            candidate = folder / f"{name}{suffix}"
+            if candidate.is_file():
+                return candidate
+    return None
+
+
+class FingerprintWriter:
+    """Writes fingerprints.json as products are exported, one product per line."""
+
+    def __init__(self, woo_dir: Path, site_root: str, captured_at: str) -> None:
+        self.path = woo_dir / "fingerprints.json"
+        self.handle = self.path.open("w", encoding="utf-8")
+        header = json.dumps({"source": site_root, "captured_at": captured_at}, ensure_ascii=False)
+        self.handle.write(header[:-1] + ', "products": {')
+        self.count = 0
+
+    def add(self, product: Dict[str, Any]) -> Dict[str, Any]:
+        entry = fingerprint_entry(product, product_fingerprint(product))
+        self.handle.write(
+            ("," if self.count else "")
+            + "\n"
+            + json.dumps(str(product.get("id")))
+            + ": "
+            + json.dumps(entry, ensure_ascii=False)
+        )
+        self.count += 1
+        return entry
+
+    def close(self) -> Path:
+        if not self.handle.closed:
+            self.handle.write("\n}}" if self.count else "}}")
+            self.handle.close()
+        return self.path
+
+
+def iter_fingerprint_entries(handle: IO[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    # Files from FingerprintWriter are read a line at a time; older files, written
+    # as a single line, are parsed whole.
+    header = handle.readline()
+    if not header.rstrip().endswith('"products": {'):
+        products = json.loads(header + handle.read()).get("products")
+        if isinstance(products, dict):
+            yield from products.items()
+        return
+    for line in handle:
+        line = line.strip().rstrip(",")
+        if line and not line.startswith("}"):
+            yield json.loads("{" + line + "}").popitem()
+
+
+class FingerprintBaseline:
+    """Fingerprints of the export a delta run is compared against."""
+
+    def __init__(self, entries: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        self.entries = dict(entries)
+        self.seen: set = set()
+
+    def take(self, key: str) -> Optional[Dict[str, Any]]:
+        # Returns the previous entry and marks the product as still in the catalog.
+        self.seen.add(key)
+        return self.entries.get(key)
+
+    def unseen(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        return ((key, entry) for key, entry in self.entries.items() if key not in self.seen)
+
+    def close(self) -> None:
+        pass
+
+
+class SpillFingerprints:
+    """SQLite-backed delta baseline for memory-bounded runs."""
+
+    def __init__(self, path: Path, entries: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        self.path = path
+        self.path.unlink(missing_ok=True)
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute(
+            "CREATE TABLE fingerprints (id TEXT PRIMARY KEY, seen INTEGER NOT NULL DEFAULT 0, data TEXT NOT NULL)"
+        )
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO fingerprints (id, data) VALUES (?, ?)",
+            ((key, json.dumps(entry, ensure_ascii=False)) for key, entry in entries),
+        )
+        self.connection.commit()
+
+    def take(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self.connection.execute("SELECT data FROM fingerprints WHERE id = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute("UPDATE fingerprints SET seen = 1 WHERE id = ?", (key,))
+        return json.loads(row[0])
+
+    def unseen(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        cursor = self.connection.execute("SELECT id, data FROM fingerprints WHERE seen = 0 ORDER BY rowid")
+        for key, data in cursor:
+            yield key, json.loads(data)
+
+    def close(self) -> None:
+        self.connection.close()
+        self.path.unlink(missing_ok=True)
+
+
+def load_previous_fingerprints(
+    export_dir: Path, spill_path: Optional[Path] = None
+) -> Union[FingerprintBaseline, SpillFingerprints]:
+    # With spill_path the baseline is streamed into SQLite instead of a dict.
+    def keep(entries: Iterable[Tuple[str, Dict[str, Any]]]) -> Union[FingerprintBaseline, SpillFingerprints]:
+        if spill_path is None:
+            return FingerprintBaseline(entries)
+        return SpillFingerprints(spill_path, entries)
+
+    fingerprints_path = find_export_file(export_dir, "fingerprints.json")
+    if fingerprints_path is not None:
+        with open_text_input(fingerprints_path) as handle:
+            return keep(iter_fingerprint_entries(handle))
+
+    # Exports written before fingerprints.json existed: rebuild from metadata.json.
+    metadata_path = find_export_file(export_dir, "metadata.json")
+    if metadata_path is None:
+        raise ValueError(f"No fingerprints.json or metadata.json found in {export_dir}.")
+    with open_text_input(metadata_path) as handle:
+        products = json.load(handle).get("products") or []
+    return keep(
+        (str(product.get("id")), fingerprint_entry(product, product_fingerprint(product)))
+        for product in products
+        if isinstance(product, dict)
+    )
+
+
+def read_max_products(payload: Dict[str, Any]) -> int:
     if has_content(payload.get("maxProducts")):
         try:
-            max_products = max(0, min(10000, int(payload.get("maxProducts"))))
+            return max(0, min(10000, int(payload.get("maxProducts"))))
         except Exception:
-            max_products = 0
+            return 0
+    return 0
+
+
+def resolve_export_root(payload: Dict[str, Any], site_root: str) -> Path:
+    export_dir = str(payload.get("exportDir") or "").strip()
+    if export_dir:
+        return Path(export_dir).expanduser().resolve()
 
     output_dir = str(payload.get("outputDir") or "").strip()
     if not output_dir:
         output_dir = str(Path.home() / "Downloads" / "woo-exports")
-
-    site_root = normalize_site_root(str(url))
     hostname = sanitize_segment(urlparse(site_root).hostname or "store")
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    root_dir = Path(output_dir).expanduser().resolve() / hostname / timestamp
+    return Path(output_dir).expanduser().resolve() / hostname / timestamp
+
+
+def write_fingerprints(
+    woo_dir: Path, site_root: str, captured_at: str, products: Iterable[Dict[str, Any]]
+) -> Path:
+    writer = FingerprintWriter(woo_dir, site_root, captured_at)
+    try:
+        for product in products:
+            writer.add(product)
+    finally:
+        writer.close()
+    return writer.path
+
+
+def write_import_csv(
+    woo_dir: Path,
+    products: Iterable[Dict[str, Any]],
+    shard_rows: int,
+    compression: str,
+    base_name: str = "woocommerce-import",
+) -> Tuple[Path, List[Dict[str, Any]]]:
+    # products is iterated twice: once for the attribute column count, once for rows.
+    max_attributes = count_max_attributes(products)
+    headers = woo_import_headers(max_attributes)
+    groups = (build_product_import_rows(product, max_attributes) for product in products)
+    if shard_rows > 0:
+        csv_path, csv_shards = write_csv_shards(
+            woo_dir, headers, groups, shard_rows, compression, base_name
+        )
+        emit_log(f"{base_name} CSV split into {len(csv_shards)} shard(s) of up to {shard_rows} rows.")
+        return csv_path, csv_shards
+
+    csv_path = compressed_path(woo_dir / f"{base_name}.csv", compression)
+    write_csv(csv_path, headers, (row for group in groups for row in group), compression)
+    emit_log(f"{csv_path.name} generated.")
+    return csv_path, []
+
+
+class ImagesIndexWriter:
+    """Writes images-index.json one product at a time, as its images finish."""
+
+    def __init__(self, woo_dir: Path) -> None:
+        self.path = woo_dir / "images-index.json"
+        self.handle = self.path.open("w", encoding="utf-8")
+        self.handle.write("{")
+        self.count = 0
+
+    def add(self, key: str, images: List[Dict[str, str]]) -> None:
+        # Same separators as json.dumps of the whole dict.
+        self.handle.write(
+            (", " if self.count else "") + json.dumps(key) + ": " + json.dumps(images, ensure_ascii=False)
+        )
+        self.count += 1
+
+    def close(self) -> Path:
+        if not self.handle.closed:
+            self.handle.write("}")
+            self.handle.close()
+        return self.path
+
+
+def write_images_index(woo_dir: Path, image_index: Iterable[Tuple[str, List[Dict[str, str]]]]) -> Path:
+    writer = ImagesIndexWriter(woo_dir)
+    try:
+        for key, images in image_index:
+            writer.add(key, images)
+    finally:
+        writer.close()
+    return writer.path
+
+
+class CatalogDatabase:
+    """Indexed SQLite copy of the exported catalog, for lookups without parsing metadata.json.
+
+    Product rows are written when a product enters the image stage and its image
+    paths when its downloads finish, committed every CATALOG_COMMIT_EVERY products.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)",
+        "CREATE TABLE products ("
+        "id TEXT PRIMARY KEY, position INTEGER NOT NULL, sku TEXT, slug TEXT, name TEXT, "
+        "type TEXT, permalink TEXT, stock_status TEXT, price TEXT, regular_price TEXT, "
+        "sale_price TEXT, currency_minor_unit INTEGER, data TEXT NOT NULL)",
+        "CREATE TABLE variations ("
+        "id TEXT, product_id TEXT NOT NULL, position INTEGER NOT NULL, sku TEXT, name TEXT, "
+        "stock_status TEXT, price TEXT, regular_price TEXT, sale_price TEXT, data TEXT NOT NULL)",
+        "CREATE TABLE attributes ("
+        "product_id TEXT NOT NULL, variation_id TEXT, name TEXT, slug TEXT, value TEXT)",
+        "CREATE TABLE categories ("
+        "product_id TEXT NOT NULL, category_id TEXT, slug TEXT, name TEXT)",
+        "CREATE TABLE images ("
+        "product_id TEXT NOT NULL, position INTEGER NOT NULL, src TEXT, path TEXT, "
+        "PRIMARY KEY (product_id, position))",
+    )
+    # Built once the rows are in: cheaper than maintaining them on every insert.
+    INDEXES = (
+        "CREATE INDEX products_sku ON products (sku)",
+        "CREATE INDEX products_slug ON products (slug)",
+        "CREATE INDEX variations_product ON variations (product_id)",
+        "CREATE INDEX variations_sku ON variations (sku)",
+        "CREATE INDEX attributes_product ON attributes (product_id)",
+        "CREATE INDEX attributes_value ON attributes (slug, value)",
+        "CREATE INDEX categories_product ON categories (product_id)",
+        "CREATE INDEX categories_slug ON categories (slug)",
+        "CREATE INDEX categories_id ON categories (category_id)",
+    )
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.path.unlink(missing_ok=True)
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        for statement in self.SCHEMA:
+            self.connection.execute(statement)
+        self.count = 0
+        self.pending = 0
+        self.closed = False
+
+    def _tick(self) -> None:
+        # Counts products only; image rows ride along with the next commit.
+        self.pending += 1
+        if self.pending >= CATALOG_COMMIT_EVERY:
+            self.connection.commit()
+            self.pending = 0
+
+    def add_product(self, product: Dict[str, Any]) -> None:
+        product_id = str(product.get("id"))
+        prices = product.get("prices") if isinstance(product.get("prices"), dict) else {}
+        execute = self.connection.execute
+        # A product seen again (overlapping pages, shards, resumed runs) replaces
+        # its earlier rows and keeps its position. The child tables are not
+        # indexed yet, so the lookup goes through the products primary key and
+        # only repeats pay for the deletes.
+        existing = execute("SELECT position FROM products WHERE id = ?", (product_id,)).fetchone()
+        if existing is not None:
+            for table in ("variations", "attributes", "categories", "images"):
+                execute(f"DELETE FROM {table} WHERE product_id = ?", (product_id,))
+        execute(
+            "INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                product_id,
+                self.count if existing is None else existing[0],
+                product.get("sku") or None,
+                product.get("slug"),
+                product.get("name"),
+                product.get("type"),
+                product.get("permalink"),
+                product.get("stock_status"),
+                prices.get("price"),
+                prices.get("regular_price"),
+                prices.get("sale_price"),
+                prices.get("currency_minor_unit"),
+                json.dumps(product, ensure_ascii=False),
+            ),
+        )
+        if existing is None:
+            self.count += 1
+        for category in product.get("categories") or []:
+            execute(
+                "INSERT INTO categories VALUES (?, ?, ?, ?)",
+                (
+                    product_id,
+                    None if category.get("id") is None else str(category.get("id")),
+                    category.get("slug"),
+                    category.get("name"),
+                ),
+            )
+        self._add_attributes(product_id, None, product.get("attributes"))
+        for position, variation in enumerate(product.get("variationDetails") or []):
+            variation_id = None if variation.get("id") is None else str(variation.get("id"))
+            variation_prices = variation.get("prices") or {}
+            execute(
+                "INSERT INTO variations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    variation_id,
+                    product_id,
+                    position,
+                    variation.get("sku") or None,
+                    variation.get("name"),
+                    variation.get("stock_status"),
+                    variation_prices.get("price"),
+                    variation_prices.get("regular_price"),
+                    variation_prices.get("sale_price"),
+                    json.dumps(variation, ensure_ascii=False),
+                ),
+            )
+            self._add_attributes(product_id, variation_id, variation.get("attributes"))
+        self._tick()
+
+    def _add_attributes(self, product_id: str, variation_id: Optional[str], attributes: Any) -> None:
+        self.connection.executemany(
+            "INSERT INTO attributes VALUES (?, ?, ?, ?, ?)",
+            [
+                (product_id, variation_id, attribute.get("name"), attribute.get("slug"), value)
+                for attribute in attributes or []
+                for value in attribute.get("options") or []
+            ],
+        )
+
+    def add_images(self, product_id: str, images: Iterable[Optional[Dict[str, str]]]) -> None:
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)",
+            [
+                (product_id, position, image["src"], image["path"])
+                for position, image in enumerate(images)
+                if image is not None
+            ],
+        )
+
+    def close(self, info: Optional[Dict[str, Any]] = None) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if info is not None:
+            for statement in self.INDEXES:
+                self.connection.execute(statement)
+            self.connection.executemany(
+                "INSERT INTO info VALUES (?, ?)",
+                [(key, None if value is None else str(value)) for key, value in info.items()],
+            )
+            self.connection.commit()
+            self.connection.execute("ANALYZE")
+        self.connection.commit()
+        self.connection.close()
+        if info is None:
+            # Failed runs leave no half-written catalog behind.
+            self.path.unlink(missing_ok=True)
+
+
+def write_catalog_db(
+    path: Path,
+    products: Iterable[Dict[str, Any]],
+    image_index: Iterable[Tuple[str, List[Dict[str, str]]]],
+    info: Dict[str, Any],
+) -> Path:
+    catalog = CatalogDatabase(path)
+    try:
+        for product in products:
+            catalog.add_product(product)
+        for key, images in image_index:
+            catalog.add_images(key, images)
+    except Exception:
+        catalog.close()
+        raise
+    catalog.close(info)
+    return path
+
+
+def resolve_bundle_format(value: Any) -> str:
+    text = str(value or "").strip().lower()
+    if text in ("", "0", "none", "off"):
+        return ""
+    if text in BUNDLE_SUFFIXES:
+        return text
+    raise ValueError(f"Unsupported bundle format: {value}")
+
+
+class ExportBundle:
+    """Single zip or tar archive that export files are appended to as they are produced.
+
+    Every member's data offset is recorded so a reader can seek straight to one
+    image instead of extracting the archive.
+    """
+
+    def __init__(self, path: Path, bundle_format: str) -> None:
+        self.path = path
+        self.format = bundle_format
+        self.index_path = path.with_name(f"{path.stem}-bundle-index.json")
+        self.members: Dict[str, Dict[str, Any]] = {}
+        self.closed = False
+        if bundle_format == "zip":
+            self.archive: Any = zipfile.ZipFile(path, "w", allowZip64=True)
+        else:
+            # Uncompressed tar: member data is stored contiguously and can be read in place.
+            self.archive = tarfile.open(path, "w", format=tarfile.PAX_FORMAT)
+
+    def locate(self, name: str) -> str:
+        return str(self.path / name)
+
+    def add_file(self, source: Path, name: str) -> str:
+        size = source.stat().st_size
+        if self.format == "zip":
+            deflate = source.suffix.lower() in BUNDLE_DEFLATE_SUFFIXES
+            self.archive.write(
+                source, name, compress_type=zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+            )
+            info = self.archive.infolist()[-1]
+            # The archive file sits right after this member's data once it is written.
+            stored_size = info.compress_size
+            offset = self.archive.fp.tell() - stored_size
+            compression = "deflated" if deflate else "stored"
+        else:
+            info = self.archive.gettarinfo(str(source), arcname=name)
+            info.uid = info.gid = 0
+            info.uname = info.gname = ""
+            with source.open("rb") as handle:
+                self.archive.addfile(info, handle)
+            stored_size = size
+            offset = self.archive.offset - -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            compression = "stored"
+        self.members[name] = {
+            "offset": offset,
+            "size": size,
+            "storedSize": stored_size,
+            "compression": compression,
+        }
+        return self.locate(name)
+
+    def add_tree(self, root: Path) -> List[Path]:
+        added = []
+        for path in sorted(root.rglob("*")):
+            if path.is_file():
+                self.add_file(path, path.relative_to(root).as_posix())
+                added.append(path)
+        return added
+
+    def close(self) -> Path:
+        if not self.closed:
+            self.closed = True
+            self.archive.close()
+            self.index_path.write_text(
+                json.dumps(
+                    {"format": self.format, "archive": self.path.name, "members": self.members},
+                    ensure_ascii=False,
+                ),
+                encoding="utf-8",
+            )
+        return self.index_path
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource is None:
+        return 0
+    # Peak rather than current RSS, but the best portable signal without /proc.
+    return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    if resource is None:
+        return current_rss_bytes()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def wait_for_memory_headroom(
+    limit_bytes: int, backlog: "queue.Queue[Any]", wait_seconds: float
+) -> None:
+    # Over the limit, pages are handed over one at a time: the consumer drains the
+    # queue first, then the next page is held until RSS drops or the wait runs out.
+    if limit_bytes <= 0 or current_rss_bytes() <= limit_bytes:
+        return
+    started = time.monotonic()
+    deadline = started + wait_seconds
+    collected = False
+    while time.monotonic() < deadline:
+        if backlog.empty():
+            if not collected:
+                gc.collect()
+                collected = True
+            if current_rss_bytes() <= limit_bytes:
+                break
+        time.sleep(0.05)
+    record_stat("memoryBackpressureMs", int((time.monotonic() - started) * 1000))
+    if current_rss_bytes() > limit_bytes:
+        record_stat("memoryLimitExceeded")
+
+
+class ProductList:
+    """Default in-memory product store."""
+
+    def __init__(self) -> None:
+        self.products: List[Dict[str, Any]] = []
+        self.skipped: set = set()
+
+    def add(self, product: Dict[str, Any]) -> None:
+        self.products.append(product)
+
+    def flush(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.products)
+
+    def items(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        return iter(enumerate(self.products))
+
+    def variation_jobs(self) -> List[Tuple[int, int]]:
+        return [
+            (key, variation_cost(product))
+            for key, product in enumerate(self.products)
+            if is_variable_product(product)
+        ]
+
+    def get(self, key: int) -> Dict[str, Any]:
+        return self.products[key]
+
+    def put(self, key: int, product: Dict[str, Any]) -> None:
+        self.products[key] = product
+
+    def exclude(self, keys: List[int]) -> None:
+        self.skipped.update(keys)
+
+    def exported(self) -> List[Dict[str, Any]]:
+        if not self.skipped:
+            return self.products
+        return [product for key, product in self.items() if key not in self.skipped]
+
+    def close(self) -> None:
+        pass
+
+
+class SpillView:
+    def __init__(self, store: "SpillStore") -> None:
+        self.store = store
+
+    def __len__(self) -> int:
+        row = self.store.connection.execute(
+            "SELECT COUNT(*) FROM products WHERE exported = 1"
+        ).fetchone()
+        return int(row[0])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for _, product in self.store.items(exported_only=True):
+            yield product
+
+
+class SpillStore:
+    """SQLite-backed product store for memory-bounded runs; one JSON row per product."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.path.unlink(missing_ok=True)
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute("PRAGMA cache_size=-16000")
+        self.connection.execute(
+            "CREATE TABLE products ("
+            "seq INTEGER PRIMARY KEY, variable INTEGER NOT NULL, cost INTEGER NOT NULL, "
+            "exported INTEGER NOT NULL DEFAULT 1, data TEXT NOT NULL)"
+        )
+        self.count = 0
+        self.pending_writes = 0
+
+    def _write(self, sql: str, params: Tuple[Any, ...]) -> None:
+        self.connection.execute(sql, params)
+        self.pending_writes += 1
+        if self.pending_writes >= SPILL_COMMIT_EVERY:
+            self.flush()
+
+    def add(self, product: Dict[str, Any]) -> None:
+        self._write(
+            "INSERT INTO products (variable, cost, data) VALUES (?, ?, ?)",
+            (
+                1 if is_variable_product(product) else 0,
+                variation_cost(product),
+                json.dumps(product, ensure_ascii=False),
+            ),
+        )
+        self.count += 1
+
+    def flush(self) -> None:
+        self.connection.commit()
+        self.pending_writes = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for _, product in self.items():
+            yield product
+
+    def items(self, exported_only: bool = False) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        self.flush()
+        sql = "SELECT seq, data FROM products"
+        if exported_only:
+            sql += " WHERE exported = 1"
+        cursor = self.connection.execute(sql + " ORDER BY seq")
+        while True:
+            batch = cursor.fetchmany(100)
+            if not batch:
+                return
+            for seq, data in batch:
+                yield seq, json.loads(data)
+
+    def variation_jobs(self) -> List[Tuple[int, int]]:
+        self.flush()
+        rows = self.connection.execute(
+            "SELECT seq, cost FROM products WHERE variable = 1 ORDER BY seq"
+        )
+        return [(row[0], row[1]) for row in rows]
+
+    def get(self, key: int) -> Dict[str, Any]:
+        row = self.connection.execute("SELECT data FROM products WHERE seq = ?", (key,)).fetchone()
+        return json.loads(row[0])
+
+    def put(self, key: int, product: Dict[str, Any]) -> None:
+        self._write(
+            "UPDATE products SET data = ? WHERE seq = ?",
+            (json.dumps(product, ensure_ascii=False), key),
+        )
+
+    def exclude(self, keys: List[int]) -> None:
+        self.connection.executemany(
+            "UPDATE products SET exported = 0 WHERE seq = ?", [(key,) for key in keys]
+        )
+        self.flush()
+
+    def exported(self) -> SpillView:
+        return SpillView(self)
+
+    def close(self) -> None:
+        self.connection.close()
+        self.path.unlink(missing_ok=True)
+
+
+def spill_products_while_fetching(
+    store: SpillStore,
+    site_root: str,
+    limit_bytes: int,
+    wait_seconds: float,
+    fetch: Callable[..., Any],
+) -> None:
+    # The fetch stage runs in its own thread and hands pages over through a bounded
+    # queue; it blocks when the queue is full or RSS is above the limit.
+    backlog: "queue.Queue[Any]" = queue.Queue(maxsize=SPILL_QUEUE_PAGES)
+    done = object()
+    failure: List[BaseException] = []
+
+    def on_page(data: List[Dict[str, Any]]) -> None:
+        wait_for_memory_headroom(limit_bytes, backlog, wait_seconds)
+        backlog.put(data)
+        if _METRICS is not None:
+            _METRICS.set_gauge("queue_depth", "spill", backlog.qsize())
+
+    def producer() -> None:
+        try:
+            fetch(on_page=on_page)
+        except BaseException as exc:  # re-raised in the consumer thread
+            failure.append(exc)
+        finally:
+            backlog.put(done)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    while True:
+        data = backlog.get()
+        if data is done:
+            break
+        if _METRICS is not None:
+            _METRICS.set_gauge("queue_depth", "spill", backlog.qsize())
+        for product in data:
+            store.add(simplify_product(product, site_root))
+        store.flush()
+    thread.join()
+    if failure:
+        raise failure[0]
+
+
+def run_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    # The shared clients, pools, tracer and metrics server are configured one
+    # by one inside export_catalog; any of them may already be live when a
+    # later setup step or the export itself fails.
+    try:
+        return export_catalog(payload)
+    finally:
+        configure_hedging(False, HEDGE_PERCENTILE, HEDGE_MAX_RATE, HEDGE_MIN_MS, 0)
+        configure_http2(False, 0)
+        configure_tracing(None)
+        configure_metrics(METRICS_HOST, 0, None, 0)
+        configure_progress(None)
+        configure_bandwidth_budget(0, 0)
+        configure_response_cache("", 0, 0)
+
+
+def export_catalog(payload: Dict[str, Any]) -> Dict[str, Any]:
+    url = payload.get("url")
+    if not has_content(url):
+        raise ValueError("Missing store URL.")
+
+    max_products = read_max_products(payload)
+    shard = payload.get("shard") if isinstance(payload.get("shard"), dict) else None
+
+    csv_shard_rows = read_int_option(payload, "csvShardRows", CSV_SHARD_ROWS)
+    compression = resolve_compression(payload.get("compress", OUTPUT_COMPRESSION))
+    bundle_format = resolve_bundle_format(payload.get("bundle", BUNDLE_FORMAT))
+    catalog_db = bool(payload.get("catalogDb", CATALOG_DB))
+    trim_fields = bool(payload.get("trimFields", TRIM_FIELDS))
+    configure_response_cache(
+        str(payload.get("cacheDir") or CACHE_DIR),
+        read_int_option(payload, "cacheTtl", CACHE_TTL_SECONDS),
+        read_int_option(payload, "cacheMaxMb", CACHE_MAX_MB),
+    )
+    image_concurrency = read_int_option(payload, "imageConcurrency", IMAGE_CONCURRENCY) or 1
+    variation_concurrency = (
+        read_int_option(payload, "variationConcurrency", VARIATION_CONCURRENCY) or 1
+    )
+    schedule = resolve_schedule(payload.get("schedule", SCHEDULE))
+    image_limits = {
+        "maxBytes": read_int_option(payload, "imageMaxKb", IMAGE_MAX_KB) * 1024,
+        "maxDimension": read_int_option(payload, "imageMaxDimension", IMAGE_MAX_DIMENSION),
+        "types": resolve_image_types(payload.get("imageTypes", IMAGE_TYPES)),
+    }
+    # Limits can only be checked on probed images, so setting one enables pre-flight.
+    image_preflight = bool(payload.get("imagePreflight", IMAGE_PREFLIGHT)) or any(image_limits.values())
+    variation_source = resolve_variation_source(
+        payload.get("variationSource", VARIATION_SOURCE)
+    )
+    configure_bandwidth_budget(
+        read_int_option(payload, "imageBandwidthKbps", IMAGE_BANDWIDTH_KBPS),
+        read_int_option(payload, "imageHostBandwidthKbps", IMAGE_HOST_BANDWIDTH_KBPS),
+    )
+    configure_hedging(
+        bool(payload.get("hedge", HEDGE_REQUESTS)),
+        read_int_option(payload, "hedgePercentile", HEDGE_PERCENTILE),
+        read_int_option(payload, "hedgeMaxRate", HEDGE_MAX_RATE),
+        read_int_option(payload, "hedgeMinMs", HEDGE_MIN_MS),
+        (image_concurrency + variation_concurrency + 2) * 2,
+    )
+    configure_http2(
+        bool(payload.get("http2", HTTP2)),
+        (image_concurrency + variation_concurrency + PAGE_CONCURRENCY) * 2,
+    )
+    memory_bounded = bool(payload.get("memoryBounded", MEMORY_BOUNDED))
+    memory_limit_bytes = read_int_option(payload, "memoryLimitMb", MEMORY_LIMIT_MB) * 1024 * 1024
+    delta_from = str(payload.get("deltaFrom") or os.environ.get("PYTHON_SCRAPER_DELTA_FROM", "")).strip()
+
+    site_root = normalize_site_root(str(url))
+    root_dir = resolve_export_root(payload, site_root)
+    shard_pages: List[List[int]] = []
+    page_start, page_step, page_limit, last_page_items = 1, 1, 0, 0
+    if shard is not None:
+        shard_index = int(shard.get("index") or 0)
+        page_step = max(1, int(shard.get("count") or 1))
+        page_start = shard_index + 1
+        page_limit = max(0, int(shard.get("pageLimit") or 0))
+        last_page_items = max(0, int(shard.get("lastPageItems") or 0))
+        root_dir = root_dir / "shards" / f"shard-{shard_index:03d}"
     woo_dir = root_dir / "woocommerce"
     products_dir = woo_dir / "products"
     products_dir.mkdir(parents=True, exist_ok=True)
+    previous_fingerprints: Optional[Union[FingerprintBaseline, SpillFingerprints]] = None
+    if delta_from:
+        previous_fingerprints = load_previous_fingerprints(
+            Path(delta_from).expanduser().resolve(),
+            woo_dir / ".baseline.sqlite" if memory_bounded else None,
+        )
 
     emit_log(f"Python extractor started for {site_root}")
     emit_log(f"Output folder: {root_dir}")
@@ -942,33 +3879,230 @@ def run_job(payload: Dict[str, Any]) -> Dict[str, Any]:
         }
     )
 
-    raw_products = fetch_products(site_root, max_products)
-    simplified = [simplify_product(product, site_root) for product in raw_products]
-    emit_log(f"Products discovered: {len(simplified)}")
-
-    variable_products = [product for product in simplified if is_variable_product(product)]
-    variation_products_total = len(variable_products)
-    variation_products_processed = 0
-    total_variations = 0
-
-    if variation_products_total > 0:
-        emit_log(f"Variable products detected: {variation_products_total}")
+    autotune = bool(payload.get("autoTune", AUTOTUNE))
+    if autotune and shard is not None:
+        emit_log("Auto-tune is disabled for shard workers; shard page ranges assume 100 products per page.")
+        autotune = False
+    tuning: Optional[Dict[str, Any]] = {} if autotune else None
+    if bundle_format and shard is not None:
+        emit_log("Bundles are written by the merge step; shard workers keep a folder export.")
+        bundle_format = ""
+    if catalog_db and shard is not None:
+        emit_log("The catalog database is written by the merge step; shard workers skip it.")
+        catalog_db = False
+
+    def fetch(on_page: Optional[Callable[[List[Dict[str, Any]]], None]] = None) -> List[Dict[str, Any]]:
+        return fetch_products(
+            site_root,
+            max_products,
+            trim_fields,
+            page_start=page_start,
+            page_step=page_step,
+            page_limit=page_limit,
+            last_page_items=last_page_items,
+            pages_out=shard_pages,
+            on_page=on_page,
+            tuning_out=tuning,
+        )
 
-    for product in variable_products:
-        product_id = product.get("id")
-        variations_raw = fetch_product_variations(site_root, product_id)
-        product["variationDetails"] = [
-            simplify_variation(variation, site_root) for variation in variations_raw
-        ]
-        total_variations += len(product["variationDetails"])
-        variation_products_processed += 1
+    store: Any
+    if memory_bounded:
         emit_log(
-            f"Product {product_id}: variations={len(product['variationDetails'])}"
+            "Memory-bounded mode: spilling products to disk "
+            f"(RSS limit {memory_limit_bytes // (1024 * 1024)} MB)."
         )
+        store = SpillStore(woo_dir / ".spill.sqlite")
+    else:
+        store = ProductList()
+    catalog: Optional[CatalogDatabase] = None
+    images_index: Optional[ImagesIndexWriter] = None
+    bundle: Optional[ExportBundle] = None
+    if bundle_format:
+        bundle = ExportBundle(root_dir / f"woocommerce{BUNDLE_SUFFIXES[bundle_format]}", bundle_format)
+        emit_log(f"Writing export bundle {bundle.path.name}.")
+
+    def finish_output(path: Path) -> str:
+        # Moves a finished output file into the bundle, if there is one.
+        if bundle is None:
+            return str(path)
+        name = bundle.add_file(path, path.relative_to(woo_dir).as_posix())
+        path.unlink()
+        return name
+
+    trace_path = woo_dir / "trace.json" if bool(payload.get("trace", TRACE)) else None
+    configure_tracing(trace_path)
+    configure_progress(
+        ProgressReporter(
+            read_int_option(payload, "progressThrottleMs", PROGRESS_THROTTLE_MS), max_products
+        )
+    )
+    metrics_port = read_int_option(payload, "metricsPort", METRICS_PORT)
+    metrics_file = str(payload.get("metricsFile") or METRICS_FILE)
+    if shard is not None:
+        # Shard workers share the coordinator's settings, so each gets its own port and file.
+        metrics_port = metrics_port + 1 + shard_index if metrics_port else 0
+        metrics_file = f"{metrics_file}.shard-{shard_index:03d}" if metrics_file else ""
+    configure_metrics(
+        str(payload.get("metricsHost") or METRICS_HOST),
+        metrics_port,
+        Path(metrics_file).expanduser() if metrics_file else None,
+        max(1, read_int_option(payload, "metricsIntervalSeconds", METRICS_INTERVAL_SECONDS)),
+    )
+    try:
+        trace_stage("scanning_products")
+        if memory_bounded:
+            spill_products_while_fetching(
+                store,
+                site_root,
+                memory_limit_bytes,
+                read_int_option(payload, "memoryWaitMs", MEMORY_WAIT_MS) / 1000,
+                fetch,
+            )
+        else:
+            for product in fetch():
+                store.add(simplify_product(product, site_root))
+        emit_log(f"Products discovered: {len(store)}")
+
+        variation_jobs = schedule_jobs(store.variation_jobs(), lambda job: job[1], schedule)
+        variation_products_total = len(variation_jobs)
+        variation_products_processed = 0
+        total_variations = 0
+        variations_from_page = 0
+        stage_timings: Dict[str, Dict[str, Any]] = {}
+
+        if variation_products_total > 0:
+            emit_log(f"Variable products detected: {variation_products_total}")
+
+        def iter_variation_jobs() -> Iterator[Tuple[Tuple[int, Dict[str, Any]], Tuple[Any, ...]]]:
+            # Products are read back from the store here, on the calling thread,
+            # and only while their request is in flight.
+            for key, _ in variation_jobs:
+                product = store.get(key)
+                yield (key, product), (
+                    fetch_variations_for_product,
+                    product,
+                    site_root,
+                    trim_fields,
+                    variation_source,
+                )
+
+        trace_stage("processing_variations")
+        variation_timer = StageTimer()
+        set_pool_size("variations", variation_concurrency)
+        with ThreadPoolExecutor(max_workers=variation_concurrency) as pool:
+            fetched = iter_windowed_results(
+                pool, timed_call, iter_variation_jobs(), variation_concurrency * 2, "variations"
+            )
+            for (key, product), future in fetched:
+                product_id = product.get("id")
+                job_started, job_finished, (variations_raw, source) = future.result()
+                variation_timer.record(job_started, job_finished)
+                product["variationDetails"] = [
+                    simplify_variation(variation, site_root, source)
+                    for variation in variations_raw
+                ]
+                store.put(key, product)
+                total_variations += len(product["variationDetails"])
+                variation_products_processed += 1
+                if source == "html" and product["variationDetails"]:
+                    variations_from_page += 1
+                emit_log(
+                    f"Product {product_id}: variations={len(product['variationDetails'])}"
+                    + (" (product page)" if source == "html" else "")
+                )
+                emit_progress(
+                    {
+                        "stage": "processing_variations",
+                        "productsDiscovered": len(store),
+                        "productsProcessed": 0,
+                        "imagesDownloaded": 0,
+                        "imagesSkipped": 0,
+                        "csvGenerated": 0,
+                        "variationProductsTotal": variation_products_total,
+                        "variationProductsProcessed": variation_products_processed,
+                    }
+                )
+        if variation_products_total > 0:
+            stage_timings["variations"] = variation_timer.summary()
+            emit_log(
+                f"Variations fetched in {stage_timings['variations']['seconds']}s "
+                f"({schedule}, {variation_concurrency} workers, "
+                f"tail {stage_timings['variations']['tailMs']} ms)."
+            )
+
+        trace_stage("writing_metadata")
+        captured_at = datetime.utcnow().isoformat() + "Z"
+        products_total = len(store)
+        removed: List[Dict[str, Any]] = []
+        unchanged_count = 0
+        # Fingerprints are written and compared with the baseline in one pass.
+        fingerprints = FingerprintWriter(woo_dir, site_root, captured_at)
+        unchanged_keys = []
+        new_count = 0
+        try:
+            for key, product in store.items():
+                entry = fingerprints.add(product)
+                if previous_fingerprints is None:
+                    continue
+                previous = previous_fingerprints.take(str(product.get("id")))
+                if previous is None:
+                    new_count += 1
+                elif previous.get("fingerprint") == entry["fingerprint"]:
+                    unchanged_keys.append(key)
+        finally:
+            fingerprints_path = fingerprints.close()
+        if bundle is not None:
+            # The loose copy stays next to the bundle as the baseline for delta exports.
+            bundle.add_file(fingerprints_path, fingerprints_path.name)
+
+        if previous_fingerprints is not None:
+            store.exclude(unchanged_keys)
+            unchanged_count = len(unchanged_keys)
+
+            if max_products > 0:
+                emit_log("Delta export with maxProducts set: removed products are not reported.")
+            else:
+                removed = [{"id": key, **entry} for key, entry in previous_fingerprints.unseen()]
+            emit_log(
+                f"Delta against {delta_from}: new={new_count}, "
+                f"changed={products_total - unchanged_count - new_count}, removed={len(removed)}, "
+                f"unchanged={unchanged_count}"
+            )
+
+        export_products = store.exported()
+        metadata_name = "metadata-delta.json" if previous_fingerprints is not None else "metadata.json"
+        metadata_path = compressed_path(woo_dir / metadata_name, compression)
+        metadata_payload: Dict[str, Any] = {
+            "source": site_root,
+            "captured_at": captured_at,
+            "total": len(export_products),
+        }
+        if shard is not None:
+            # Ahead of the products, so the merge step has the page list before
+            # it streams them.
+            metadata_payload["shard"] = {**shard, "pages": shard_pages}
+        metadata_payload["products"] = export_products
+        if previous_fingerprints is not None:
+            metadata_payload["baseline"] = delta_from
+            metadata_payload["removed"] = removed
+        write_metadata_json(metadata_path, metadata_payload, compression)
+        emit_log(f"{metadata_path.name} generated.")
+        metadata_file = finish_output(metadata_path)
+        if catalog_db:
+            catalog_name = "catalog-delta.sqlite" if previous_fingerprints is not None else "catalog.sqlite"
+            catalog = CatalogDatabase(woo_dir / catalog_name)
+
+            def catalog_products() -> Iterator[Dict[str, Any]]:
+                # Rows go in as products are handed to the image stage; image
+                # paths follow as each product's downloads finish.
+                for product in export_products:
+                    catalog.add_product(product)
+                    yield product
+
         emit_progress(
             {
-                "stage": "processing_variations",
-                "productsDiscovered": len(simplified),
+                "stage": "downloading_images",
+                "productsDiscovered": products_total,
                 "productsProcessed": 0,
                 "imagesDownloaded": 0,
                 "imagesSkipped": 0,
@@ -978,144 +4112,904 @@ def run_job(payload: Dict[str, Any]) -> Dict[str, Any]:
             }
         )
 
-    metadata_path = woo_dir / "metadata.json"
-    metadata_payload = {
-        "source": site_root,
-        "captured_at": datetime.utcnow().isoformat() + "Z",
-        "total": len(simplified),
-        "products": simplified,
-    }
-    metadata_path.write_text(
-        json.dumps(metadata_payload, indent=2, ensure_ascii=False),
-        encoding="utf-8",
-    )
-    emit_log("metadata.json generated.")
-
-    emit_progress(
-        {
-            "stage": "downloading_images",
-            "productsDiscovered": len(simplified),
-            "productsProcessed": 0,
-            "imagesDownloaded": 0,
-            "imagesSkipped": 0,
-            "csvGenerated": 0,
-            "variationProductsTotal": variation_products_total,
-            "variationProductsProcessed": variation_products_processed,
-        }
-    )
-
-    images_downloaded = 0
-    images_skipped = 0
-    products_processed = 0
-
-    for product in simplified:
-        product_slug = sanitize_segment(product.get("slug") or product.get("id"))
-        product_id = sanitize_segment(product.get("id") or "item")
-        image_dir = products_dir / f"{product_slug}-{product_id}" / "images"
-        image_dir.mkdir(parents=True, exist_ok=True)
+        images_downloaded = 0
+        images_skipped = 0
+        products_processed = products_total - len(export_products)
+        image_slots: Dict[str, List[Optional[Dict[str, str]]]] = {}
+        images_pending: Dict[str, int] = {}
+
+        # Each product's slots are written out and dropped as soon as its last
+        # image finishes, so only products with downloads in flight are held.
+        images_index = ImagesIndexWriter(woo_dir)
+
+        def finish_product_images(key: str) -> None:
+            slots = image_slots.pop(key)
+            images_pending.pop(key, None)
+            images_index.add(key, [entry for entry in slots if entry is not None])
+            if catalog is not None:
+                catalog.add_images(key, slots)
+
+        staging_dir = woo_dir / ".bundle"
+        if bundle is not None:
+            staging_dir.mkdir(exist_ok=True)
+
+        def image_task(candidates: List[str], image_dir: Path) -> Tuple[Any, ...]:
+            download: Tuple[Any, ...] = (
+                (download_image, image_dir) if bundle is None else (stage_image, image_dir, staging_dir)
+            )
+            if image_preflight:
+                return (preflight_image, candidates, image_limits, *download)
+            return (download[0], candidates[0], *download[1:])
+
+        image_jobs: Iterable[Tuple[Tuple[str, int, str], Optional[Tuple[Any, ...]]]] = (
+            (meta, None if args is None else image_task(*args))
+            for meta, args in iter_image_jobs(
+                catalog_products() if catalog is not None else export_products,
+                products_dir,
+                image_slots,
+                create_dirs=bundle is None,
+                collapse_sizes=image_preflight,
+            )
+        )
+        if schedule == "ljf" and memory_bounded:
+            # Products with the most images go first within each window, so the
+            # job list stays a stream.
+            image_jobs = schedule_windowed(
+                image_jobs, lambda job: len(image_slots[job[0][0]]), SCHEDULE_WINDOW
+            )
+        elif schedule == "ljf":
+            # Only the (small) job tuples are materialized; products with the
+            # most images go first.
+            image_jobs = schedule_jobs(
+                list(image_jobs), lambda job: len(image_slots[job[0][0]]), schedule
+            )
 
-        image_urls: List[str] = []
-        seen = set()
-        for image in product.get("images") or []:
-            if isinstance(image, dict) and has_content(image.get("src")):
-                src = str(image["src"])
-                if src not in seen:
-                    seen.add(src)
-                    image_urls.append(src)
+        images_total: Optional[int] = None
+        if isinstance(image_jobs, list):
+            images_total = sum(1 for _, args in image_jobs if args is not None)
 
-        for variation in product.get("variationDetails") or []:
-            if not isinstance(variation, dict):
-                continue
-            image = variation.get("image")
-            if isinstance(image, dict) and has_content(image.get("src")):
-                src = str(image["src"])
-                if src not in seen:
-                    seen.add(src)
-                    image_urls.append(src)
-
-        for image_url in image_urls:
-            try:
-                result = download_image(image_url, image_dir)
-                if result.get("skipped"):
+        trace_stage("downloading_images")
+        image_timer = StageTimer()
+        set_pool_size("images", image_concurrency)
+        with ThreadPoolExecutor(max_workers=image_concurrency) as pool:
+            downloads = iter_windowed_results(
+                pool, timed_call, image_jobs, image_concurrency * 4, "images"
+            )
+            for (key, position, image_url), future in downloads:
+                if future is None:
+                    products_processed += 1
+                    finish_product_images(key)
+                    continue
+                images_pending.setdefault(key, len(image_slots[key]))
+                try:
+                    job_started, job_finished, result = future.result()
+                    image_timer.record(job_started, job_finished)
+                    if bundle is not None and has_content(result.get("staged")):
+                        staged = Path(result["staged"])
+                        bundle.add_file(staged, Path(result["path"]).relative_to(woo_dir).as_posix())
+                        staged.unlink()
+                    if has_content(result.get("path")):
+                        image_slots[key][position] = {
+                            "src": result.get("src") or image_url,
+                            "path": Path(result["path"]).relative_to(woo_dir).as_posix(),
+                        }
+                    if result.get("filtered"):
+                        record_stat("imagesFiltered")
+                        emit_log(f"Image skipped by pre-flight ({image_url}): {result['filtered']}")
+                    if result.get("skipped"):
+                        images_skipped += 1
+                    else:
+                        images_downloaded += 1
+                except Exception as exc:
                     images_skipped += 1
-                else:
-                    images_downloaded += 1
-            except Exception as exc:
-                images_skipped += 1
-                emit_log(f"Image download failed ({image_url}): {exc}")
+                    emit_log(f"Image download failed ({image_url}): {exc}")
+
+                images_pending[key] -= 1
+                if images_pending[key] == 0:
+                    products_processed += 1
+                    finish_product_images(key)
+                emit_progress(
+                    {
+                        "stage": "downloading_images",
+                        "productsDiscovered": products_total,
+                        "productsProcessed": products_processed,
+                        "imagesTotal": images_total,
+                        "imagesDownloaded": images_downloaded,
+                        "imagesSkipped": images_skipped,
+                        "csvGenerated": 0,
+                        "variationProductsTotal": variation_products_total,
+                        "variationProductsProcessed": variation_products_processed,
+                    }
+                )
+
+        if image_timer.jobs:
+            stage_timings["images"] = image_timer.summary()
+            emit_log(
+                f"Images downloaded in {stage_timings['images']['seconds']}s "
+                f"({schedule}, {image_concurrency} workers, "
+                f"tail {stage_timings['images']['tailMs']} ms)."
+            )
+        if image_preflight:
+            stats = network_stats()
+            emit_log(
+                f"Image pre-flight: probes={stats.get('imageProbeRequests', 0)}, "
+                f"size variants collapsed={stats.get('imageVariantsCollapsed', 0)}, "
+                f"filtered={stats.get('imagesFiltered', 0)}"
+            )
 
-            emit_progress(
+        if bundle is not None:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            try:
+                products_dir.rmdir()
+            except OSError:
+                pass
+
+        trace_stage("writing_outputs")
+        images_index_path = images_index.close()
+        csv_base = "woocommerce-import-delta" if previous_fingerprints is not None else "woocommerce-import"
+        csv_path, csv_shards = write_import_csv(
+            woo_dir, export_products, csv_shard_rows, compression, csv_base
+        )
+        csv_shard_files = [finish_output(woo_dir / entry["file"]) for entry in csv_shards]
+        csv_file = finish_output(csv_path)
+        images_index_file = finish_output(images_index_path)
+        if catalog is not None:
+            catalog.close(
                 {
-                    "stage": "downloading_images",
-                    "productsDiscovered": len(simplified),
-                    "productsProcessed": products_processed,
-                    "imagesDownloaded": images_downloaded,
-                    "imagesSkipped": images_skipped,
-                    "csvGenerated": 0,
-                    "variationProductsTotal": variation_products_total,
-                    "variationProductsProcessed": variation_products_processed,
+                    "source": site_root,
+                    "captured_at": captured_at,
+                    "total": catalog.count,
+                    "baseline": delta_from or None,
                 }
             )
+            emit_log(f"{catalog.path.name} generated.")
+            if bundle is not None:
+                # Kept loose as well: SQLite cannot query it inside the archive.
+                bundle.add_file(catalog.path, catalog.path.name)
+        bundle_index_path = bundle.close() if bundle is not None else None
 
-        products_processed += 1
         emit_progress(
             {
-                "stage": "downloading_images",
-                "productsDiscovered": len(simplified),
+                "stage": "completed",
+                "productsDiscovered": products_total,
                 "productsProcessed": products_processed,
                 "imagesDownloaded": images_downloaded,
                 "imagesSkipped": images_skipped,
-                "csvGenerated": 0,
+                "csvGenerated": 1,
                 "variationProductsTotal": variation_products_total,
                 "variationProductsProcessed": variation_products_processed,
             }
         )
 
-    headers, rows = build_woo_import_rows(simplified)
-    csv_path = woo_dir / "woocommerce-import.csv"
-    write_csv(csv_path, headers, rows)
-    emit_log("woocommerce-import.csv generated.")
+        emit_log(
+            f"Export completed: products={products_total}, variations={total_variations}, images={images_downloaded}"
+        )
+        stats = network_stats()
+        emit_log(
+            f"API transfer: requests={stats.get('apiRequests', 0)}, "
+            f"bytesOnWire={stats.get('apiBytesOnWire', 0)}, decoded={stats.get('apiBytesDecoded', 0)}"
+        )
+        cache_lookups = sum(
+            stats.get(key, 0) for key in ("cacheHits", "cacheRevalidated", "cacheMisses")
+        )
+        cache_hit_ratio = (
+            round((stats.get("cacheHits", 0) + stats.get("cacheRevalidated", 0)) / cache_lookups, 4)
+            if cache_lookups
+            else None
+        )
+        if stats.get("memoryLimitExceeded"):
+            emit_log(
+                f"RSS stayed above the {memory_limit_bytes // (1024 * 1024)} MB limit "
+                f"after {stats['memoryLimitExceeded']} products page(s); consider a higher limit."
+            )
+        if _HEDGER is not None:
+            thresholds = ", ".join(
+                f"{kind} {value} ms" for kind, value in sorted(_HEDGER.thresholds_ms().items())
+            )
+            emit_log(
+                f"Hedged requests: issued={stats.get('hedgesIssued', 0)}, "
+                f"won={stats.get('hedgesWon', 0)}, "
+                f"p{_HEDGER.percentile} thresholds: {thresholds or 'not enough samples'}"
+            )
+        if _HTTP2 is not None:
+            emit_log(
+                f"HTTP/2 transport: {stats.get('http2Requests', 0)} request(s) over HTTP/2, "
+                "the rest over HTTP/1.1."
+            )
+        if _RESPONSE_CACHE is not None:
+            emit_log(
+                f"Response cache: hits={stats.get('cacheHits', 0)}, "
+                f"revalidated={stats.get('cacheRevalidated', 0)}, misses={stats.get('cacheMisses', 0)}"
+            )
+
+        return {
+            "source": site_root,
+            "outputDir": str(root_dir),
+            "files": {
+                "metadataJson": metadata_file,
+                "importCsv": csv_file,
+                "importCsvShards": csv_shard_files,
+                "fingerprints": str(fingerprints_path),
+                "imagesIndex": images_index_file,
+                "trace": str(trace_path) if trace_path is not None else None,
+                "bundle": str(bundle.path) if bundle is not None else None,
+                "bundleIndex": str(bundle_index_path) if bundle_index_path is not None else None,
+                "catalogDb": str(catalog.path) if catalog is not None else None,
+            },
+            "summary": {
+                "productsDiscovered": products_total,
+                "productsProcessed": products_processed,
+                "variableProducts": variation_products_total,
+                "variationsDiscovered": total_variations,
+                "variationProductsFromPage": variations_from_page,
+                "imagesDownloaded": images_downloaded,
+                "imagesSkipped": images_skipped,
+                "csvGenerated": True,
+                "csvShards": len(csv_shards),
+                "compression": compression or None,
+                "bundle": bundle_format or None,
+                "bundleMembers": len(bundle.members) if bundle is not None else None,
+                "apiRequests": stats.get("apiRequests", 0),
+                "apiBytesOnWire": stats.get("apiBytesOnWire", 0),
+                "apiBytesDecoded": stats.get("apiBytesDecoded", 0),
+                "downloadBytes": stats.get("downloadBytes", 0),
+                "bandwidthWaitMs": stats.get("bandwidthWaitMs", 0),
+                "memoryBounded": memory_bounded,
+                "peakRssMb": round(peak_rss_bytes() / (1024 * 1024), 1),
+                "memoryBackpressureMs": stats.get("memoryBackpressureMs", 0),
+                "cacheHits": stats.get("cacheHits", 0),
+                "cacheRevalidated": stats.get("cacheRevalidated", 0),
+                "cacheMisses": stats.get("cacheMisses", 0),
+                "cacheHitRatio": cache_hit_ratio,
+                "autotune": tuning,
+                "hedgesIssued": stats.get("hedgesIssued", 0),
+                "hedgesWon": stats.get("hedgesWon", 0),
+                "imagePreflight": image_preflight,
+                "imageProbeRequests": stats.get("imageProbeRequests", 0),
+                "imageVariantsCollapsed": stats.get("imageVariantsCollapsed", 0),
+                "imagesFiltered": stats.get("imagesFiltered", 0),
+                "http2": _HTTP2 is not None,
+                "http2Requests": stats.get("http2Requests", 0),
+                "schedule": schedule,
+                "stageTimings": stage_timings,
+                "delta": {
+                    "baseline": delta_from,
+                    "exported": len(export_products),
+                    "removed": len(removed),
+                    "unchanged": unchanged_count,
+                }
+                if previous_fingerprints is not None
+                else None,
+            },
+        }
+    finally:
+        store.close()
+        if previous_fingerprints is not None:
+            previous_fingerprints.close()
+        if images_index is not None:
+            images_index.close()
+        if bundle is not None:
+            bundle.close()
+        if catalog is not None:
+            catalog.close()
+
+
+def shard_metadata_path(shard_dir: Path) -> Path:
+    metadata_path = find_export_file(shard_dir, "metadata.json")
+    if metadata_path is None:
+        raise RuntimeError(f"Shard {shard_dir.name} has no metadata.json; did its worker finish?")
+    return metadata_path
+
+
+def read_shard_header(shard_dir: Path) -> Dict[str, Any]:
+    # The members written before the product list: source, total and shard.
+    header: Dict[str, Any] = {}
+    with open_text_input(shard_metadata_path(shard_dir)) as handle:
+        for key, value in iter_json_members(handle, "products"):
+            if key == "products":
+                break
+            header[key] = value
+    return header
+
+
+def iter_shard_products(shard_dir: Path) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    # Yields (page, position on the page, product) in the order the shard wrote them.
+    slots: Iterator[Tuple[int, int]] = iter(())
+    ordinal = 0
+    with open_text_input(shard_metadata_path(shard_dir)) as handle:
+        for key, value in iter_json_members(handle, "products"):
+            if key == "shard" and isinstance(value, dict):
+                slots = (
+                    (int(page), position)
+                    for page, count in value.get("pages") or []
+                    for position in range(int(count))
+                )
+            elif key == "products":
+                yield (*next(slots, (0, ordinal)), value)
+                ordinal += 1
+
+
+def iter_shard_images(shard_dir: Path) -> Iterator[Tuple[str, List[Dict[str, str]]]]:
+    index_path = shard_dir / "woocommerce" / "images-index.json"
+    if not index_path.is_file():
+        return
+    with index_path.open("r", encoding="utf-8") as handle:
+        yield from iter_json_members(handle)
+
+
+class ShardMerge:
+    """Shard exports merged back into catalog order, streamed afresh on every pass.
+
+    Shards crawl interleaved pages and each one lists its products in page
+    order, so a k-way merge on (page, position) rebuilds the catalog while
+    holding one product per shard. Products seen on two pages (the catalog
+    shifted during the crawl) are kept once.
+    """
+
+    def __init__(self, shard_dirs: List[Path], max_products: int) -> None:
+        self.shard_dirs = shard_dirs
+        self.max_products = max_products
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        streams = [iter_shard_products(shard_dir) for shard_dir in self.shard_dirs]
+        seen_ids = set()
+        for _, _, product in heapq.merge(*streams, key=lambda item: (item[0], item[1])):
+            if self.max_products > 0 and len(seen_ids) >= self.max_products:
+                return
+            key = str(product.get("id"))
+            if key in seen_ids:
+                continue
+            seen_ids.add(key)
+            yield product
+
+
+def move_tree_contents(source: Path, target: Path) -> None:
+    target.mkdir(parents=True, exist_ok=True)
+    for entry in source.iterdir():
+        destination = target / entry.name
+        if entry.is_dir() and destination.exists():
+            move_tree_contents(entry, destination)
+        elif not destination.exists():
+            os.replace(entry, destination)
+
+
+def merge_shard_exports(payload: Dict[str, Any]) -> Dict[str, Any]:
+    url = payload.get("url")
+    export_dir = str(payload.get("exportDir") or "").strip()
+    if not export_dir:
+        raise ValueError("Merging shards requires exportDir.")
+
+    root_dir = Path(export_dir).expanduser().resolve()
+    shard_dirs = sorted(path for path in (root_dir / "shards").glob("shard-*") if path.is_dir())
+    if not shard_dirs:
+        raise ValueError(f"No shard exports found under {root_dir / 'shards'}.")
+
+    woo_dir = root_dir / "woocommerce"
+    woo_dir.mkdir(parents=True, exist_ok=True)
+    compression = resolve_compression(payload.get("compress", OUTPUT_COMPRESSION))
+    bundle_format = resolve_bundle_format(payload.get("bundle", BUNDLE_FORMAT))
+    catalog_db = bool(payload.get("catalogDb", CATALOG_DB))
+    csv_shard_rows = read_int_option(payload, "csvShardRows", CSV_SHARD_ROWS)
+    max_products = read_max_products(payload)
+
+    source = normalize_site_root(str(url)) if has_content(url) else ""
+    for shard_dir in shard_dirs:
+        header = read_shard_header(shard_dir)
+        source = source or str(header.get("source") or "")
+        products_dir = shard_dir / "woocommerce" / "products"
+        if products_dir.is_dir():
+            move_tree_contents(products_dir, woo_dir / "products")
+        emit_log(f"Merged {shard_dir.name}: products={header.get('total', 0)}")
+
+    # Every output below streams its own pass over the shard files. The first
+    # one writes the fingerprints and counts what metadata.json needs up front.
+    merged = ShardMerge(shard_dirs, max_products)
+    captured_at = datetime.utcnow().isoformat() + "Z"
+    fingerprints = FingerprintWriter(woo_dir, source, captured_at)
+    total = variable_products = variations = 0
+    # maxProducts is capped at 10000, so the ids of a truncated merge stay small.
+    merged_ids: Optional[set] = set() if max_products > 0 else None
+    try:
+        for product in merged:
+            fingerprints.add(product)
+            total += 1
+            variable_products += 1 if is_variable_product(product) else 0
+            variations += len(product.get("variationDetails") or [])
+            if merged_ids is not None:
+                merged_ids.add(str(product.get("id")))
+    finally:
+        fingerprints_path = fingerprints.close()
+
+    images_stored = 0
+
+    def merged_images() -> Iterator[Tuple[str, List[Dict[str, str]]]]:
+        nonlocal images_stored
+        images_stored = 0
+        seen_ids = set()
+        for shard_dir in shard_dirs:
+            for key, images in iter_shard_images(shard_dir):
+                if key in seen_ids or (merged_ids is not None and key not in merged_ids):
+                    continue
+                seen_ids.add(key)
+                images_stored += len(images)
+                yield key, images
+
+    metadata_path = compressed_path(woo_dir / "metadata.json", compression)
+    write_metadata_json(
+        metadata_path,
+        {"source": source, "captured_at": captured_at, "total": total, "products": merged},
+        compression,
+    )
+    images_index_path = write_images_index(woo_dir, merged_images())
+    csv_path, csv_shards = write_import_csv(woo_dir, merged, csv_shard_rows, compression)
+    catalog_path = None
+    if catalog_db:
+        catalog_path = write_catalog_db(
+            woo_dir / "catalog.sqlite",
+            merged,
+            merged_images(),
+            {"source": source, "captured_at": captured_at, "total": total, "baseline": None},
+        )
+
+    files: Dict[str, Any] = {
+        "metadataJson": str(metadata_path),
+        "importCsv": str(csv_path),
+        "importCsvShards": [str(woo_dir / entry["file"]) for entry in csv_shards],
+        "fingerprints": str(fingerprints_path),
+        "imagesIndex": str(images_index_path),
+        "catalogDb": str(catalog_path) if catalog_path is not None else None,
+    }
+    if bundle_format:
+        # Shard workers write folders; the merged tree is packed in one pass.
+        bundle = ExportBundle(root_dir / f"woocommerce{BUNDLE_SUFFIXES[bundle_format]}", bundle_format)
+        try:
+            packed = bundle.add_tree(woo_dir)
+        finally:
+            files["bundleIndex"] = str(bundle.close())
+        for path in packed:
+            if path not in (fingerprints_path, catalog_path):
+                path.unlink()
+        shutil.rmtree(woo_dir / "products", ignore_errors=True)
+        for key in ("metadataJson", "importCsv", "imagesIndex"):
+            files[key] = bundle.locate(Path(files[key]).relative_to(woo_dir).as_posix())
+        files["importCsvShards"] = [bundle.locate(entry["file"]) for entry in csv_shards]
+        files["bundle"] = str(bundle.path)
+        emit_log(f"Packed {len(packed)} file(s) into {bundle.path.name}.")
+    # Written after packing so it stays next to the bundle, as in a single-worker run.
+    trace_path = merge_shard_traces(shard_dirs, woo_dir / "trace.json")
+    files["trace"] = str(trace_path) if trace_path is not None else None
+    shutil.rmtree(root_dir / "shards", ignore_errors=True)
+
+    emit_log(f"Merged {len(shard_dirs)} shard(s): products={total}, variations={variations}")
+    return {
+        "source": source,
+        "outputDir": str(root_dir),
+        "files": files,
+        "summary": {
+            "productsDiscovered": total,
+            "productsProcessed": total,
+            "variableProducts": variable_products,
+            "variationsDiscovered": variations,
+            "imagesStored": images_stored,
+            "csvGenerated": True,
+            "csvShards": len(csv_shards),
+            "compression": compression or None,
+            "bundle": bundle_format or None,
+            "crawlShards": len(shard_dirs),
+        },
+    }
 
+
+def merge_shard_traces(shard_dirs: List[Path], destination: Path) -> Optional[Path]:
+    # Worker traces already use distinct pids; shift each onto a shared clock and
+    # name its process after the shard.
+    traces = []
+    for shard_dir in shard_dirs:
+        trace_path = shard_dir / "woocommerce" / "trace.json"
+        if not trace_path.is_file():
+            continue
+        try:
+            with trace_path.open("r", encoding="utf-8") as handle:
+                traces.append((shard_dir.name, json.load(handle)))
+        except ValueError as exc:
+            emit_log(f"Skipped the trace of {shard_dir.name}: {exc}")
+    if not traces:
+        return None
+    starts = [float((trace.get("otherData") or {}).get("startTime") or 0) for _, trace in traces]
+    origin = min(starts)
+    with destination.open("w", encoding="utf-8") as handle:
+        handle.write(Tracer.HEADER % origin)
+        count = 0
+        for (name, trace), started in zip(traces, starts):
+            shift = int((started - origin) * 1_000_000)
+            events = trace.get("traceEvents") or []
+            pids = {event.get("pid") for event in events}
+            events = [
+                {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}} for pid in pids
+            ] + events
+            for event in events:
+                if "ts" in event:
+                    event["ts"] += shift
+                handle.write((",\n" if count else "") + json.dumps(event, ensure_ascii=False))
+                count += 1
+        handle.write("\n]}\n")
+    emit_log(f"Merged {len(traces)} shard trace(s) into {destination.name}.")
+    return destination
+
+
+def relay_worker_output(
+    index: int, process: "subprocess.Popen[str]", state: Dict[str, Any]
+) -> None:
+    for line in process.stdout:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            emit_log(f"[shard {index}] {line.rstrip()}")
+            continue
+        if event.get("type") == "log":
+            emit_log(f"[shard {index}] {event.get('message')}")
+        elif event.get("type") == "progress":
+            with state["lock"]:
+                state["progress"][index] = event.get("patch") or {}
+                patches = list(state["progress"].values())
+            emit_progress(aggregate_progress(patches, state["count"]))
+        elif event.get("type") == "result":
+            state["results"][index] = event.get("result") or {}
+        elif event.get("type") == "error":
+            state["errors"][index] = str(event.get("message"))
+
+
+def aggregate_progress(patches: List[Dict[str, Any]], shard_count: int) -> Dict[str, Any]:
+    stages = [str(patch.get("stage") or STAGE_ORDER[0]) for patch in patches]
+    if len(patches) < shard_count:
+        stages.append(STAGE_ORDER[0])
+    stage = min(stages, key=lambda name: STAGE_ORDER.index(name) if name in STAGE_ORDER else 0)
+    aggregated: Dict[str, Any] = {"stage": "downloading_images" if stage == "completed" else stage}
+    for key in (
+        "productsTotal",
+        "productsDiscovered",
+        "productsProcessed",
+        "imagesDownloaded",
+        "imagesSkipped",
+        "variationProductsTotal",
+        "variationProductsProcessed",
+    ):
+        aggregated[key] = sum(int(patch.get(key) or 0) for patch in patches)
+    for key in ("productsPerSecond", "variationProductsPerSecond", "imagesPerSecond", "mbPerSecond"):
+        aggregated[key] = round(sum(float(patch.get(key) or 0) for patch in patches), 2)
+    # Shards run in parallel, so the slowest one decides; unknown if any is unknown.
+    etas = [patch.get("etaSeconds") for patch in patches]
+    aggregated["etaSeconds"] = (
+        max(etas) if etas and len(patches) == shard_count and None not in etas else None
+    )
+    aggregated["csvGenerated"] = 0
+    return aggregated
+
+
+def run_coordinator(payload: Dict[str, Any]) -> Dict[str, Any]:
+    url = payload.get("url")
+    if not has_content(url):
+        raise ValueError("Missing store URL.")
+
+    site_root = normalize_site_root(str(url))
+    root_dir = resolve_export_root(payload, site_root)
+    shard_count = read_int_option(payload, "workers", SHARD_WORKERS) or 1
+    max_products = read_max_products(payload)
+    page_limit = -(-max_products // PRODUCTS_PER_PAGE) if max_products > 0 else 0
+    last_page_items = max_products - (page_limit - 1) * PRODUCTS_PER_PAGE if page_limit else 0
+    if has_content(payload.get("deltaFrom")):
+        emit_log("deltaFrom is ignored for sharded crawls; run a delta against the merged export.")
+
+    emit_log(f"Sharded crawl of {site_root} with {shard_count} worker(s).")
+    emit_log(f"Output folder: {root_dir}")
+    base_payload = {
+        key: value
+        for key, value in payload.items()
+        if key not in ("mode", "workers", "deltaFrom", "compress", "csvShardRows", "bundle", "catalogDb")
+    }
+    state: Dict[str, Any] = {
+        "lock": threading.Lock(),
+        "count": shard_count,
+        "progress": {},
+        "results": {},
+        "errors": {},
+    }
+    processes = []
+    relays = []
+    for index in range(shard_count):
+        worker_payload = {
+            **base_payload,
+            "maxProducts": 0,
+            "exportDir": str(root_dir),
+            "shard": {
+                "index": index,
+                "count": shard_count,
+                "pageLimit": page_limit,
+                "lastPageItems": last_page_items,
+            },
+        }
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+        )
+        process.stdin.write(json.dumps(worker_payload))
+        process.stdin.close()
+        relay = threading.Thread(target=relay_worker_output, args=(index, process, state), daemon=True)
+        relay.start()
+        processes.append(process)
+        relays.append(relay)
+
+    for index, process in enumerate(processes):
+        code = process.wait()
+        relays[index].join()
+        if code != 0 and index not in state["errors"]:
+            state["errors"][index] = f"exit code {code}"
+    if state["errors"]:
+        details = "; ".join(f"shard {index}: {message}" for index, message in sorted(state["errors"].items()))
+        raise RuntimeError(f"Sharded crawl failed ({details}). Partial output kept in {root_dir}.")
+
+    result = merge_shard_exports({**payload, "exportDir": str(root_dir)})
+    worker_totals: Dict[str, Any] = {}
+    for worker_result in state["results"].values():
+        for key, value in (worker_result.get("summary") or {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                worker_totals[key] = worker_totals.get(key, 0) + value
+    merged = result["summary"]
+    for key, value in worker_totals.items():
+        merged.setdefault(key, value)
     emit_progress(
         {
             "stage": "completed",
-            "productsDiscovered": len(simplified),
-            "productsProcessed": products_processed,
-            "imagesDownloaded": images_downloaded,
-            "imagesSkipped": images_skipped,
+            "productsDiscovered": merged["productsDiscovered"],
+            "productsProcessed": merged["productsProcessed"],
+            "imagesDownloaded": merged.get("imagesDownloaded", 0),
+            "imagesSkipped": merged.get("imagesSkipped", 0),
             "csvGenerated": 1,
-            "variationProductsTotal": variation_products_total,
-            "variationProductsProcessed": variation_products_processed,
+            "variationProductsTotal": merged["variableProducts"],
+            "variationProductsProcessed": merged["variableProducts"],
         }
     )
+    return result
 
-    emit_log(
-        f"Export completed: products={len(simplified)}, variations={total_variations}, images={images_downloaded}"
+
+def spread_sample(items: List[Any], count: int) -> List[Any]:
+    # Evenly spaced picks, so samples are not all taken from the newest products.
+    if count <= 0 or not items:
+        return []
+    if count >= len(items):
+        return list(items)
+    step = (len(items) - 1) / max(1, count - 1)
+    return [items[round(index * step)] for index in range(count)]
+
+
+def find_last_page(page_length: Callable[[int], int]) -> Tuple[int, int]:
+    # Used when the store sends no X-WP-Total header and page 1 is full:
+    # doubles the page number until a short page, then bisects.
+    low, high = 1, 2
+    length = page_length(high)
+    while length >= PRODUCTS_PER_PAGE:
+        low, high = high, high * 2
+        length = page_length(high)
+    if length > 0:
+        return high, length
+    while high - low > 1:
+        middle = (low + high) // 2
+        length = page_length(middle)
+        if length >= PRODUCTS_PER_PAGE:
+            low = middle
+        elif length == 0:
+            high = middle
+        else:
+            return middle, length
+    return low, PRODUCTS_PER_PAGE
+
+
+def mean(values: List[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+
+def run_estimate(payload: Dict[str, Any]) -> Dict[str, Any]:
+    url = payload.get("url")
+    if not has_content(url):
+        raise ValueError("Missing store URL.")
+
+    site_root = normalize_site_root(str(url))
+    trim_fields = bool(payload.get("trimFields", TRIM_FIELDS))
+    max_products = read_max_products(payload)
+    sample_pages = read_int_option(payload, "samplePages", ESTIMATE_SAMPLE_PAGES) or 1
+    sample_variations = read_int_option(payload, "sampleVariations", ESTIMATE_SAMPLE_VARIATIONS)
+    head_images = read_int_option(payload, "headImages", ESTIMATE_HEAD_IMAGES)
+    image_concurrency = read_int_option(payload, "imageConcurrency", IMAGE_CONCURRENCY) or 1
+    variation_concurrency = (
+        read_int_option(payload, "variationConcurrency", VARIATION_CONCURRENCY) or 1
     )
+    bandwidth_kbps = read_int_option(payload, "imageBandwidthKbps", IMAGE_BANDWIDTH_KBPS)
 
-    return {
-        "source": site_root,
-        "outputDir": str(root_dir),
-        "files": {
-            "metadataJson": str(metadata_path),
-            "importCsv": str(csv_path),
-        },
-        "summary": {
-            "productsDiscovered": len(simplified),
-            "productsProcessed": products_processed,
-            "variableProducts": variation_products_total,
-            "variationsDiscovered": total_variations,
-            "imagesDownloaded": images_downloaded,
-            "imagesSkipped": images_skipped,
-            "csvGenerated": True,
+    emit_log(f"Estimating export size for {site_root} (nothing is written).")
+    page_samples: List[Tuple[float, int]] = []
+
+    def sample_page(page: int, headers_out: Optional[Dict[str, str]] = None) -> Any:
+        before = network_stats().get("apiBytesOnWire", 0)
+        started = time.monotonic()
+        data = request_json(
+            products_endpoint(site_root, PRODUCTS_PER_PAGE, page, trim_fields),
+            headers_out=headers_out,
+        )
+        page_samples.append(
+            (time.monotonic() - started, network_stats().get("apiBytesOnWire", 0) - before)
+        )
+        return data
+
+    def page_length(page: int) -> int:
+        try:
+            data = sample_page(page)
+        except RuntimeError:
+            # Some stores answer pages past the end with 400 instead of [].
+            return 0
+        return len(data) if isinstance(data, list) else 0
+
+    headers: Dict[str, str] = {}
+    first_page = sample_page(1, headers)
+    if not isinstance(first_page, list):
+        raise RuntimeError(f"Unexpected products response from {site_root}.")
+
+    total_header = str(headers.get("x-wp-total") or "").strip()
+    if total_header.isdigit():
+        products_total, count_source = int(total_header), "X-WP-Total"
+    elif len(first_page) < PRODUCTS_PER_PAGE:
+        products_total, count_source = len(first_page), "first page"
+    else:
+        last_page, last_length = find_last_page(page_length)
+        products_total = (last_page - 1) * PRODUCTS_PER_PAGE + last_length
+        count_source = "page search"
+    if max_products > 0:
+        products_total = min(products_total, max_products)
+    products_pages = -(-products_total // PRODUCTS_PER_PAGE)
+    emit_log(f"Catalog size: {products_total} products in {products_pages} page(s) ({count_source}).")
+
+    sampled_raw = list(first_page)
+    for page in spread_sample(list(range(2, products_pages + 1)), sample_pages - 1):
+        data = sample_page(page)
+        if isinstance(data, list):
+            sampled_raw.extend(data)
+    products = [simplify_product(product, site_root) for product in sampled_raw]
+    variable = [product for product in products if is_variable_product(product)]
+    product_images = [len(collect_product_image_urls(product)) for product in products]
+
+    variation_seconds: List[float] = []
+    variation_bytes: List[int] = []
+    variation_calls: List[int] = []
+    sampled_variations = 0
+    variation_images = 0
+    for product in spread_sample(variable, sample_variations):
+        stats_before = network_stats()
+        started = time.monotonic()
+        raw_variations = fetch_product_variations(site_root, product.get("id"), trim_fields)
+        stats_after = network_stats()
+        calls = max(1, stats_after.get("apiRequests", 0) - stats_before.get("apiRequests", 0))
+        variation_calls.append(calls)
+        variation_seconds.append((time.monotonic() - started) / calls)
+        variation_bytes.append(
+            (stats_after.get("apiBytesOnWire", 0) - stats_before.get("apiBytesOnWire", 0)) // calls
+        )
+        own_images = len(collect_product_image_urls(product))
+        product["variationDetails"] = [
+            simplify_variation(variation, site_root) for variation in raw_variations
+        ]
+        sampled_variations += len(raw_variations)
+        variation_images += len(collect_product_image_urls(product)) - own_images
+
+    image_sizes: List[int] = []
+    head_seconds: List[float] = []
+    if head_images > 0:
+        image_urls = [url for product in products for url in collect_product_image_urls(product)]
+        for image_url in spread_sample(image_urls, head_images):
+            started = time.monotonic()
+            try:
+                image_headers = request_head(image_url)
+            except RuntimeError as exc:
+                emit_log(f"Image HEAD failed ({image_url}): {exc}")
+                continue
+            head_seconds.append(time.monotonic() - started)
+            length = str(image_headers.get("content-length") or "").strip()
+            if length.isdigit():
+                image_sizes.append(int(length))
+
+    variable_ratio = len(variable) / len(products) if products else 0.0
+    variations_per_product = mean([float(variation_cost(product)) for product in variable])
+    images_per_product = mean([float(count) for count in product_images])
+    images_per_variation = variation_images / sampled_variations if sampled_variations else 0.0
+    average_image_bytes = int(mean([float(size) for size in image_sizes])) if image_sizes else None
+
+    page_seconds = mean([seconds for seconds, _ in page_samples])
+    page_bytes = mean([float(size) for _, size in page_samples])
+    request_seconds = mean(variation_seconds) or page_seconds
+    bytes_per_second = sum(size for _, size in page_samples) / max(
+        sum(seconds for seconds, _ in page_samples), 1e-6
+    )
+
+    variable_total = round(products_total * variable_ratio)
+    variations_total = round(variable_total * variations_per_product)
+    variation_requests = round(variable_total * (mean([float(c) for c in variation_calls]) or 1.0))
+    images_total = round(
+        products_total * images_per_product + variations_total * images_per_variation
+    )
+    image_bytes = images_total * average_image_bytes if average_image_bytes is not None else None
+
+    # Each image costs one round trip (HEAD latency when sampled) plus its
+    # transfer at the per-connection rate seen on API pages, spread over the
+    # image workers; a configured bandwidth cap is a floor on the total.
+    image_seconds = images_total * (mean(head_seconds) or request_seconds) / image_concurrency
+    if image_bytes is not None:
+        image_seconds += image_bytes / max(bytes_per_second, 1.0) / image_concurrency
+        if bandwidth_kbps > 0:
+            image_seconds = max(image_seconds, image_bytes / (bandwidth_kbps * 1024))
+    durations = {
+        "products": round(products_pages * page_seconds, 1),
+        "variations": round(variation_requests * request_seconds / variation_concurrency, 1),
+        "images": round(image_seconds, 1),
+    }
+    durations["total"] = round(sum(durations.values()), 1)
+    requests = {
+        "products": products_pages,
+        "variations": variation_requests,
+        "images": images_total,
+    }
+    requests["total"] = sum(requests.values())
+
+    summary = {
+        "mode": "estimate",
+        "productsTotal": products_total,
+        "countSource": count_source,
+        "productsPages": products_pages,
+        "sampledProducts": len(products),
+        "sampledVariableProducts": len(variation_calls),
+        "sampledImageHeads": len(image_sizes),
+        "variableRatio": round(variable_ratio, 3),
+        "variationsPerVariableProduct": round(variations_per_product, 2),
+        "imagesPerProduct": round(images_per_product, 2),
+        "imagesPerVariation": round(images_per_variation, 2),
+        "averageImageBytes": average_image_bytes,
+        "projected": {
+            "variableProducts": variable_total,
+            "variations": variations_total,
+            "images": images_total,
+            "requests": requests,
+            "apiBytes": round(products_pages * page_bytes + variation_requests * mean(
+                [float(size) for size in variation_bytes]
+            )),
+            "imageBytes": image_bytes,
+            "durationSeconds": durations,
         },
+        "sampleRequests": network_stats().get("apiRequests", 0) + len(head_seconds),
     }
+    emit_log(
+        f"Projected: {variable_total} variable products, {variations_total} variations, "
+        f"{images_total} images, {requests['total']} requests, about {durations['total']} s"
+        + ("" if image_bytes is None else f", {round(image_bytes / (1024 * 1024), 1)} MB of images")
+        + "."
+    )
+    return {"source": site_root, "outputDir": None, "files": {}, "summary": summary}
+
+
+JOB_MODES = {
+    "export": run_job,
+    "coordinate": run_coordinator,
+    "merge": merge_shard_exports,
+    "estimate": run_estimate,
+}
 
 
 def main() -> int:
     try:
         payload = read_input_payload()
-        result = run_job(payload)
+        mode = str(payload.get("mode") or "export").strip().lower()
+        if mode not in JOB_MODES:
+            raise ValueError(f"Unsupported job mode: {mode}")
+        result = JOB_MODES[mode](payload)
         emit({"type": "result", "result": result})
         return 0
     except Exception as exc: